@@ -0,0 +1,92 @@
+"""
+Compara os motores de carimbo (opção motor_carimbo) em um lote de
+páginas parecidas com um DACTE: texto em tabela, linhas e a imagem
+do código de barras.
+
+Uso: python benchmarks/bench_carimbo.py [quantidade]
+"""
+import os
+import random
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from src.pdf_utils import MOTORES_CARIMBO, criar_motor_carimbo, fechar_leitores
+
+TEXTO = "V: R$ 1.234,56\nB: R$ 789,01\nA: R$ 10,00"
+
+
+def imagem_barcode(semente):
+    rnd = random.Random(semente)
+    img = Image.new("L", (600, 80), 255)
+    x = 0
+    while x < 600:
+        largura = rnd.choice((2, 4, 6))
+        if rnd.random() < 0.5:
+            img.paste(0, (x, 0, min(600, x + largura), 80))
+        x += largura
+    return ImageReader(img)
+
+
+def gerar_lote(caminho, quantidade):
+    c = canvas.Canvas(caminho, pagesize=A4)
+    largura, altura = A4
+    for n in range(1, quantidade + 1):
+        c.setFont("Helvetica-Bold", 12)
+        c.drawString(40, altura - 50, "DACTE - Documento Auxiliar do Conhecimento de Transporte Eletrônico")
+        c.drawImage(imagem_barcode(n), 300, altura - 140, width=260, height=40)
+
+        c.setFont("Helvetica", 7)
+        y = altura - 170
+        for linha in range(60):
+            c.line(30, y - 2, largura - 30, y - 2)
+            for coluna in range(6):
+                c.drawString(35 + coluna * 90, y, f"CAMPO {linha:02d}.{coluna} VALOR {n * 7 + linha}")
+            y -= 10
+        c.rect(30, 60, largura - 60, altura - 220)
+        c.showPage()
+    c.save()
+
+
+def medir(motor, origem, quantidade, pasta):
+    modelo = criar_motor_carimbo(motor)
+    inicio = perf_counter()
+    for pagina in range(quantidade):
+        _, dados = modelo.carimbar(origem, TEXTO, pagina)
+        with open(os.path.join(pasta, f"{motor}_{pagina}.pdf"), "wb") as f:
+            f.write(dados)
+    tempo = perf_counter() - inicio
+    modelo.fechar()
+    fechar_leitores()
+    return tempo
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+
+    with tempfile.TemporaryDirectory() as pasta:
+        origem = os.path.join(pasta, "lote.pdf")
+        gerar_lote(origem, quantidade)
+
+        # Aquece o cache de disco e os imports antes de medir
+        medir("pypdf", origem, min(quantidade, 10), pasta)
+
+        print(f"Páginas:     {quantidade}")
+        tempos = {}
+        for motor in MOTORES_CARIMBO:
+            tempos[motor] = medir(motor, origem, quantidade, pasta)
+            t = tempos[motor]
+            print(f"{motor + ':':<12} {t:.3f}s ({t / quantidade * 1e3:.2f} ms/CT-e)")
+
+    print(f"ganho:       {tempos['pypdf'] / tempos['pymupdf']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
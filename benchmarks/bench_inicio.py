@@ -0,0 +1,61 @@
+"""
+Mede a partida a frio da CLI (python -m src --help e import src.rateio) e
+confere que importar src.rateio não carrega as bibliotecas pesadas.
+Sai com código 1 se passar do orçamento.
+
+Uso: python benchmarks/bench_inicio.py [orcamento_em_segundos] [repeticoes]
+"""
+import os
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ORCAMENTO_PADRAO = 0.5
+PESADAS = ("pandas", "numpy", "fitz", "pymupdf", "PyPDF2", "reportlab", "pyzbar", "PIL", "customtkinter")
+
+
+def medir(comando, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = perf_counter()
+        subprocess.run(comando, cwd=RAIZ, stdout=subprocess.DEVNULL, check=True)
+        tempos.append(perf_counter() - inicio)
+    return statistics.median(tempos)
+
+
+def modulos_pesados():
+    codigo = (
+        "import sys, src.rateio; "
+        f"print(','.join(m for m in {PESADAS!r} if m in sys.modules))"
+    )
+    saida = subprocess.run([sys.executable, "-c", codigo], cwd=RAIZ,
+                           capture_output=True, text=True, check=True)
+    return [m for m in saida.stdout.strip().split(",") if m]
+
+
+def main():
+    orcamento = float(sys.argv[1]) if len(sys.argv) > 1 else ORCAMENTO_PADRAO
+    repeticoes = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    t_python = medir([sys.executable, "-c", "pass"], repeticoes)
+    t_cli = medir([sys.executable, "-m", "src", "--help"], repeticoes)
+    t_rateio = medir([sys.executable, "-c", "import src.rateio"], repeticoes)
+    t_pesadas = medir([sys.executable, "-c", "import pandas, fitz, PyPDF2"], repeticoes)
+    carregadas = modulos_pesados()
+
+    print(f"python vazio:        {t_python:.3f}s")
+    print(f"python -m src:       {t_cli:.3f}s (orçamento {orcamento:.3f}s)")
+    print(f"import src.rateio:   {t_rateio:.3f}s (orçamento {orcamento:.3f}s)")
+    print(f"pandas+fitz+PyPDF2:  {t_pesadas:.3f}s (referência)")
+    print(f"pesadas no import:   {', '.join(carregadas) or 'nenhuma'}")
+
+    if max(t_cli, t_rateio) > orcamento or carregadas:
+        print("FORA DO ORÇAMENTO")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
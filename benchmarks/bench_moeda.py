@@ -0,0 +1,74 @@
+"""
+Compara o cálculo do rateio com Decimal (quantize por linha + acerto na
+menor linha) com o motor em centavos inteiros (maiores restos em lote).
+
+Uso: python benchmarks/bench_moeda.py [quantidade_de_cte]
+"""
+import os
+import random
+import sys
+from decimal import Decimal, ROUND_HALF_UP
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.generalsutils import formato_brl
+from src.moeda import formato_centavos, ratear_grupos
+
+
+def gerar_lote(quantidade, semente=0):
+    rnd = random.Random(semente)
+    grupos = []
+    for _ in range(quantidade):
+        linhas = [rnd.randint(1, 500_000) for _ in range(rnd.randint(1, 12))]
+        # Metade com diferença de 1 centavo, metade fora da tolerância
+        total = sum(linhas) + rnd.choice((-1, 1, rnd.randint(-5000, 5000)))
+        grupos.append((max(total, 1), linhas))
+    return grupos
+
+
+def caminho_decimal(grupos):
+    textos = []
+    for total, linhas in grupos:
+        valor_cte = Decimal(total).scaleb(-2)
+        itens = [{"valor": Decimal(c).scaleb(-2).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)} for c in linhas]
+        soma = sum(i["valor"] for i in itens).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+        diferenca = (valor_cte - soma).quantize(Decimal("0.01"))
+        if diferenca != Decimal("0.00") and abs(diferenca) <= Decimal("0.01"):
+            min(itens, key=lambda x: x["valor"])["valor"] += diferenca
+        textos.append([formato_brl(i["valor"]) for i in itens])
+    return textos
+
+
+def caminho_centavos(grupos):
+    partes = ratear_grupos([t for t, _ in grupos], [l for _, l in grupos])
+    return [[formato_centavos(v) for v in valores] for valores in partes]
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    grupos = gerar_lote(quantidade)
+    linhas = sum(len(l) for _, l in grupos)
+
+    inicio = perf_counter()
+    caminho_decimal(grupos)
+    t_decimal = perf_counter() - inicio
+
+    inicio = perf_counter()
+    partes = caminho_centavos(grupos)
+    t_centavos = perf_counter() - inicio
+
+    exatos = sum(
+        sum(int(v.replace(".", "").replace(",", "")) for v in valores) == total
+        for (total, _), valores in zip(grupos, partes)
+    )
+
+    print(f"CT-es:       {quantidade} ({linhas} linhas)")
+    print(f"Decimal:     {t_decimal:.3f}s")
+    print(f"centavos:    {t_centavos:.3f}s")
+    print(f"ganho:       {t_decimal / t_centavos:.1f}x")
+    print(f"soma exata:  {exatos}/{quantidade}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Compara o processamento em fases (padrão) com o pipeline (opção pipeline):
+tempo total e tempo até o primeiro PDF rateado aparecer na pasta de saída.
+O lote tem os DACTEs num único PDF, em ordem inversa à da planilha.
+
+Uso: python benchmarks/bench_pipeline.py [quantidade]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz
+import pandas as pd
+
+from bench_xml import gerar_xmls
+from src.rateio import processar
+
+
+def gerar_lote(pasta, quantidade):
+    xmls = os.path.join(pasta, "xml")
+    pdfs = os.path.join(pasta, "pdf")
+    os.makedirs(xmls)
+    os.makedirs(pdfs)
+    caminhos = gerar_xmls(xmls, quantidade)
+
+    doc = fitz.open()
+    for caminho in reversed(caminhos):
+        chave = os.path.basename(caminho)[:44]
+        page = doc.new_page()
+        page.insert_text((40, 50), "DACTE - Documento Auxiliar do Conhecimento de Transporte Eletrônico", fontsize=11)
+        page.insert_text((300, 80), " ".join(chave[i:i + 4] for i in range(0, 44, 4)), fontsize=8)
+        for linha in range(60):
+            page.insert_text((35, 120 + linha * 11), f"CAMPO {linha:02d} " * 8, fontsize=6)
+    doc.save(os.path.join(pdfs, "lote.pdf"))
+    doc.close()
+
+    linhas = []
+    for n in range(1, quantidade + 1):
+        linhas.append({"N° CT-e": n, "Vlr Contabil": "800,00", "Operação": "VENDA"})
+        linhas.append({"N° CT-e": n, "Vlr Contabil": "434,56", "Operação": "BONIFICACAO"})
+    planilha = os.path.join(pasta, "plan.xlsx")
+    pd.DataFrame(linhas).to_excel(planilha, index=False)
+    return planilha, pdfs, xmls
+
+
+def medir(planilha, pdfs, xmls, saida, pipeline):
+    shutil.rmtree(saida, ignore_errors=True)
+    os.makedirs(saida)
+    primeiro = []
+    fim = threading.Event()
+
+    def vigiar(inicio):
+        while not fim.is_set():
+            if any(n.endswith("_rateado.pdf") for n in os.listdir(saida)):
+                primeiro.append(perf_counter() - inicio)
+                return
+            sleep(0.005)
+
+    opcoes = {"pipeline": pipeline, "cache_xml": False, "cache_barcode": False, "cache_planilha": False}
+    inicio = perf_counter()
+    vigia = threading.Thread(target=vigiar, args=(inicio,), daemon=True)
+    vigia.start()
+    resumo = processar(planilha, pdfs, xmls, saida, False, False,
+                       lambda msg, tag=None: None, lambda msg: None, opcoes=opcoes)
+    total = perf_counter() - inicio
+    fim.set()
+    vigia.join()
+    return total, (primeiro[0] if primeiro else total), resumo["sucesso"]
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as pasta:
+        planilha, pdfs, xmls = gerar_lote(pasta, quantidade)
+        saida = os.path.join(pasta, "saida")
+
+        for nome, pipeline in (("fases", False), ("pipeline", True)):
+            total, primeiro, sucesso = medir(planilha, pdfs, xmls, saida, pipeline)
+            print(f"{nome:9} total {total:.2f}s | primeiro PDF {primeiro:.2f}s | {sucesso} CT-es")
+
+
+if __name__ == "__main__":
+    main()
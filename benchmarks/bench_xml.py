@@ -0,0 +1,81 @@
+"""
+Compara a leitura de XML de CT-e pelo iterparse (ElementTree)
+com a leitura direta dos bytes.
+
+Uso: python benchmarks/bench_xml.py [quantidade]
+"""
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.xml_utils import extrair_dados_cte
+
+MODELO = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<cteProc xmlns="http://www.portalfiscal.inf.br/cte" versao="4.00">'
+    '<CTe xmlns="http://www.portalfiscal.inf.br/cte">'
+    '<infCte Id="CTe{chave}" versao="4.00">'
+    '<ide><cUF>35</cUF><CFOP>6353</CFOP><natOp>PRESTACAO DE SERVICO</natOp>'
+    '<mod>57</mod><serie>1</serie><nCT>{numero:09d}</nCT><dhEmi>2024-01-05T10:00:00-03:00</dhEmi>'
+    '<tpImp>1</tpImp><tpEmis>1</tpEmis><tpAmb>1</tpAmb><tpCTe>0</tpCTe></ide>'
+    '<emit><CNPJ>12345678000199</CNPJ><xNome>TRANSPORTADORA</xNome></emit>'
+    '{preenchimento}'
+    '<vPrest><vTPrest>{valor}</vTPrest><vRec>{valor}</vRec></vPrest>'
+    '<imp><ICMS><ICMS00><CST>00</CST></ICMS00></ICMS></imp>'
+    '<infCTeNorm><infCarga><vCarga>1000.00</vCarga></infCarga></infCTeNorm>'
+    '</infCte></CTe>'
+    '<protCTe versao="4.00"><infProt><chCTe>{chave}</chCTe><cStat>100</cStat></infProt></protCTe>'
+    '</cteProc>'
+)
+
+
+def gerar_xmls(pasta, quantidade):
+    # Blocos de remetente/destinatário para aproximar o tamanho de um CT-e real
+    preenchimento = "".join(
+        f"<rem><CNPJ>{i:014d}</CNPJ><xNome>CLIENTE {i}</xNome>"
+        f"<enderReme><xLgr>RUA {i}</xLgr><nro>{i}</nro><xMun>SAO PAULO</xMun></enderReme></rem>"
+        for i in range(20)
+    )
+    caminhos = []
+    for n in range(1, quantidade + 1):
+        chave = f"3524011234567800019957001{n:09d}1{n:08d}0"
+        caminho = os.path.join(pasta, f"{chave}-procCTe.xml")
+        with open(caminho, "w", encoding="utf-8") as f:
+            f.write(MODELO.format(chave=chave, numero=n, valor="1234.56", preenchimento=preenchimento))
+        caminhos.append(caminho)
+    return caminhos
+
+
+def medir(caminhos, rapido):
+    inicio = perf_counter()
+    for caminho in caminhos:
+        extrair_dados_cte(caminho, rapido=rapido)
+    return perf_counter() - inicio
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminhos = gerar_xmls(pasta, quantidade)
+
+        for caminho in caminhos[:50]:
+            assert extrair_dados_cte(caminho, rapido=True) == extrair_dados_cte(caminho, rapido=False)
+
+        # Aquece o cache de disco antes de medir
+        medir(caminhos, rapido=True)
+
+        t_arvore = medir(caminhos, rapido=False)
+        t_bytes = medir(caminhos, rapido=True)
+
+    print(f"XMLs:        {quantidade}")
+    print(f"iterparse:   {t_arvore:.3f}s ({t_arvore / quantidade * 1e6:.0f} us/arquivo)")
+    print(f"bytes:       {t_bytes:.3f}s ({t_bytes / quantidade * 1e6:.0f} us/arquivo)")
+    print(f"ganho:       {t_arvore / t_bytes:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import multiprocessing
 import customtkinter as ctk  # Importação da lib moderna
 from src.gui import RateioGUI
 
@@ -36,4 +37,6 @@ def main():
     app.mainloop()
 
 if __name__ == "__main__":
+    # Necessário para os processos de leitura de XML no executável (PyInstaller)
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
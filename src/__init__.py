@@ -1 +1,6 @@
-from .gui import RateioGUI
+def __getattr__(nome):
+    # Importação tardia: os processos auxiliares importam src.* sem carregar a interface
+    if nome == "RateioGUI":
+        from .gui import RateioGUI
+        return RateioGUI
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
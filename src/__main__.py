@@ -0,0 +1,144 @@
+"""
+Execução sem interface (agendamentos, lotes noturnos):
+
+    python -m src --planilha plan.xlsx --pdfs PDFS --xml XMLS --saida SAIDA
+    python -m src --config config/config.json --opcao processos_paginas=4
+
+Sem --config, usa os caminhos e opções salvos pela interface
+(config/config.json), se existir; argumentos têm prioridade.
+O progresso sai no stdout como JSON, um evento por linha.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+
+from .config import CONFIG_FILE, OPCOES_PADRAO
+
+# Mesmas chaves salvas pela interface
+CAMPOS_CAMINHO = ("planilha", "pdfs", "xml", "saida")
+
+
+def emitir(evento, **dados):
+    print(json.dumps({"evento": evento, **dados}, default=str), flush=True)
+
+
+class ProgressoJSON:
+    """Substitui a barra de progresso: processar faz progresso["value"] = i"""
+
+    def __init__(self):
+        self.maximo = None
+
+    def __setitem__(self, campo, valor):
+        if campo == "maximum":
+            self.maximo = valor
+        elif campo == "value":
+            emitir("progresso", atual=valor, total=self.maximo)
+
+
+def _valor_opcao(texto):
+    try:
+        return json.loads(texto)
+    except ValueError:
+        return texto
+
+
+def criar_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m src",
+        description="Rateio de CT-e sem interface gráfica.",
+    )
+    parser.add_argument("--config", help="JSON no formato do config/config.json")
+    parser.add_argument("--planilha", help="planilha do rateio (.xlsx, .xls ou .csv)")
+    parser.add_argument("--pdfs", help="pasta (ou .zip) com os PDFs dos CT-es")
+    parser.add_argument("--xml", help="pasta (ou .zip) com os XMLs dos CT-es")
+    parser.add_argument("--saida", help="pasta onde os PDFs rateados são gravados")
+    parser.add_argument("--pdf-unico", action="store_true", default=None,
+                        help="gera também o PDF unificado")
+    parser.add_argument("--mover-xml", action="store_true", default=None,
+                        help="move os XMLs processados para 'XML Processados'")
+    parser.add_argument("--retomar", action="store_true",
+                        help="continua a execução interrompida com as mesmas entradas (diário na pasta de saída)")
+    parser.add_argument("--opcao", action="append", default=[], metavar="CHAVE=VALOR",
+                        help="sobrescreve uma opção avançada (valor em JSON); pode repetir")
+    return parser
+
+
+def montar_parametros(args):
+    """Junta o arquivo de configuração e os argumentos (que têm prioridade)"""
+    caminho_config = args.config or (CONFIG_FILE if CONFIG_FILE.exists() else None)
+    cfg = {}
+    if caminho_config:
+        with open(caminho_config, "r", encoding="utf-8") as f:
+            cfg = json.load(f)
+
+    parametros = {campo: getattr(args, campo) or cfg.get(campo, "") for campo in CAMPOS_CAMINHO}
+    parametros["pdf_unico"] = bool(args.pdf_unico if args.pdf_unico is not None else cfg.get("pdf_unico", False))
+    parametros["mover_xml"] = bool(args.mover_xml if args.mover_xml is not None else cfg.get("mover_xml", False))
+
+    opcoes = {**OPCOES_PADRAO, **cfg.get("opcoes", {})}
+    for item in args.opcao:
+        chave, separador, valor = item.partition("=")
+        if not separador or chave not in OPCOES_PADRAO:
+            raise ValueError(f"Opção inválida: {item!r}")
+        opcoes[chave] = _valor_opcao(valor)
+    parametros["opcoes"] = opcoes
+    return parametros
+
+
+def main(argv=None):
+    parser = criar_parser()
+    args = parser.parse_args(argv)
+
+    try:
+        parametros = montar_parametros(args)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    faltando = [campo for campo in ("planilha", "saida") if not parametros[campo]]
+    if faltando:
+        parser.error(f"informe: {', '.join('--' + c for c in faltando)}")
+    if not os.path.isfile(parametros["planilha"]):
+        parser.error(f"planilha não encontrada: {parametros['planilha']}")
+    os.makedirs(parametros["saida"], exist_ok=True)
+
+    # Ctrl+C (ou SIGTERM do agendador) pede a parada como o botão CANCELAR
+    stop_event = threading.Event()
+
+    def parar(*_):
+        emitir("status", mensagem="Interrompendo...")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, parar)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, parar)
+
+    from .rateio import processar
+
+    resumo = processar(
+        planilha=parametros["planilha"],
+        pasta_pdfs=parametros["pdfs"],
+        pasta_xml=parametros["xml"],
+        pasta_saida=parametros["saida"],
+        pdf_unico=parametros["pdf_unico"],
+        mover_xml=parametros["mover_xml"],
+        logger_func=lambda msg, tag=None: emitir("log", nivel=tag or "info", mensagem=msg),
+        status_func=lambda msg: emitir("status", mensagem=msg),
+        progresso=ProgressoJSON(),
+        stop_event=stop_event,
+        opcoes=parametros["opcoes"],
+        retomar=args.retomar,
+    )
+    emitir("resumo", **(resumo or {}))
+
+    if resumo and resumo["concluido"]:
+        return 0
+    return 130 if stop_event.is_set() else 1
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
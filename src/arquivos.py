@@ -0,0 +1,219 @@
+import hashlib
+import os
+import re
+import threading
+import zipfile
+from typing import NamedTuple
+
+
+# =====================================================
+# ENTRADAS (ARQUIVOS SOLTOS OU DENTRO DE ZIP)
+# =====================================================
+
+class Entrada(NamedTuple):
+    """
+    Arquivo de entrada: um arquivo em disco ou um membro de um ZIP.
+    Para membros, caminho é o ZIP e mtime é o do próprio ZIP.
+    """
+    caminho: str
+    membro: str | None = None
+    tamanho: int = 0
+    mtime: int = 0
+
+    @property
+    def nome(self) -> str:
+        return os.path.basename(self.membro or self.caminho)
+
+    @property
+    def id(self) -> str:
+        if self.membro:
+            return f"{os.path.abspath(self.caminho)}::{self.membro}"
+        return os.path.abspath(self.caminho)
+
+
+_zips = {}
+_zips_lock = threading.Lock()
+
+
+def _abrir_zip(caminho: str) -> zipfile.ZipFile:
+    """
+    Mantém um ZipFile aberto por arquivo, evitando reler o diretório
+    central do ZIP a cada membro.
+    """
+    with _zips_lock:
+        zf = _zips.get(caminho)
+        if zf is None:
+            zf = zipfile.ZipFile(caminho)
+            _zips[caminho] = zf
+        return zf
+
+
+def _descartar_zips_herdados():
+    """
+    Processo filho (fork) não usa os ZipFile do pai: o descritor herdado
+    compartilha a posição de leitura com o pai e com os outros filhos.
+    """
+    global _zips, _zips_lock
+    _zips = {}
+    _zips_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_descartar_zips_herdados)
+
+
+def fechar_zips():
+    with _zips_lock:
+        for zf in _zips.values():
+            try: zf.close()
+            except Exception: pass
+        _zips.clear()
+
+
+def eh_zip(caminho: str) -> bool:
+    return caminho.lower().endswith(".zip") and os.path.isfile(caminho)
+
+
+def _membros_zip(caminho: str, extensao: str, mtime: int):
+    try:
+        zf = _abrir_zip(caminho)
+    except (OSError, zipfile.BadZipFile):
+        return []
+
+    return [
+        Entrada(caminho, info.filename, info.file_size, mtime)
+        for info in zf.infolist()
+        if not info.is_dir() and info.filename.lower().endswith(extensao)
+    ]
+
+
+def hash_conteudo(entrada) -> str:
+    """
+    Hash (BLAKE2b) do conteúdo de uma entrada, lido em blocos.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    if isinstance(entrada, Entrada) and entrada.membro:
+        arquivo = _abrir_zip(entrada.caminho).open(entrada.membro)
+    else:
+        arquivo = open(entrada.caminho if isinstance(entrada, Entrada) else entrada, "rb")
+
+    with arquivo:
+        for bloco in iter(lambda: arquivo.read(1024 * 1024), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def ler_bytes(entrada) -> bytes:
+    """
+    Lê o conteúdo completo de uma entrada (ou de um caminho em disco).
+    """
+    if isinstance(entrada, Entrada) and entrada.membro:
+        return _abrir_zip(entrada.caminho).read(entrada.membro)
+
+    caminho = entrada.caminho if isinstance(entrada, Entrada) else entrada
+    with open(caminho, "rb") as f:
+        return f.read()
+
+
+# =====================================================
+# INVENTÁRIO DAS PASTAS DE ENTRADA
+# =====================================================
+
+# Pastas geradas pelo próprio sistema, ignoradas na varredura recursiva
+PASTAS_IGNORADAS = {"_split_temp", "XML Processados"}
+
+_RE_CHAVE_NOME = re.compile(r"(?<!\d)(\d{44})(?!\d)")
+
+
+def chave_no_nome(nome: str) -> str | None:
+    """
+    Sequência de 44 dígitos presente no nome do arquivo, se houver.
+    """
+    achado = _RE_CHAVE_NOME.search(nome)
+    return achado.group(1) if achado else None
+
+
+class Inventario:
+    """
+    Varre as pastas de entrada uma única vez (os.scandir) e indexa os
+    arquivos por origem e extensão, por chave presente no nome e por id
+    (com tamanho e data de modificação). As fases do processamento
+    consultam o inventário em vez de listar as pastas novamente.
+    """
+
+    def __init__(self, origens, extensoes=(".xml", ".pdf"), recursivo: bool = False):
+        self.extensoes = tuple(e.lower() for e in extensoes)
+        self.recursivo = recursivo
+        self.por_origem = {}
+        self.por_chave = {}
+        self.por_id = {}
+
+        for origem in origens:
+            if not origem or not os.path.exists(origem):
+                continue
+            chave_origem = os.path.abspath(origem)
+            if chave_origem not in self.por_origem:
+                self.por_origem[chave_origem] = {ext: [] for ext in self.extensoes}
+                self._varrer(origem, self.por_origem[chave_origem])
+
+    def _registrar(self, entrada: Entrada, destino: dict):
+        ext = os.path.splitext(entrada.nome)[1].lower()
+        if ext not in destino:
+            return
+        destino[ext].append(entrada)
+        self.por_id[entrada.id] = entrada
+
+        chave = chave_no_nome(entrada.nome)
+        if chave:
+            self.por_chave.setdefault(chave, []).append(entrada)
+
+    def _registrar_zip(self, caminho: str, mtime: int, destino: dict):
+        for ext in self.extensoes:
+            for entrada in _membros_zip(caminho, ext, mtime):
+                self._registrar(entrada, destino)
+
+    def _varrer(self, origem: str, destino: dict):
+        if eh_zip(origem):
+            self._registrar_zip(origem, os.stat(origem).st_mtime_ns, destino)
+            return
+
+        pendentes = [origem]
+        while pendentes:
+            pasta = pendentes.pop()
+            try:
+                it = os.scandir(pasta)
+            except OSError:
+                continue
+
+            with it:
+                for item in it:
+                    if item.is_dir(follow_symlinks=False):
+                        if self.recursivo and item.name not in PASTAS_IGNORADAS:
+                            pendentes.append(item.path)
+                        continue
+                    if not item.is_file():
+                        continue
+
+                    nome = item.name.lower()
+                    if nome.endswith(".zip"):
+                        self._registrar_zip(item.path, item.stat().st_mtime_ns, destino)
+                    elif nome.endswith(self.extensoes):
+                        st = item.stat()
+                        self._registrar(Entrada(item.path, None, st.st_size, st.st_mtime_ns), destino)
+
+    def listar(self, origem: str, extensao: str) -> list[Entrada]:
+        """
+        Entradas de uma origem (pasta ou ZIP) com a extensão informada.
+        """
+        grupos = self.por_origem.get(os.path.abspath(origem), {})
+        return grupos.get(extensao.lower(), [])
+
+    def buscar_chave(self, chave: str, extensao: str | None = None) -> list[Entrada]:
+        """
+        Entradas cujo nome contém a chave, na ordem em que foram registradas.
+        """
+        entradas = self.por_chave.get(chave, [])
+        if extensao:
+            extensao = extensao.lower()
+            entradas = [e for e in entradas if e.nome.lower().endswith(extensao)]
+        return entradas
@@ -0,0 +1,215 @@
+import os
+import sqlite3
+from decimal import Decimal
+from time import time
+
+
+# =====================================================
+# CACHE DE XML
+# =====================================================
+
+class CacheXML:
+    """
+    Índice persistente (SQLite) dos XMLs já lidos.
+    Cada arquivo é identificado por caminho, tamanho e data de modificação;
+    se algum deles mudar, o XML é lido novamente.
+    """
+
+    def __init__(self, caminho):
+        os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+        self.conn = sqlite3.connect(str(caminho))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS xml ("
+            " caminho TEXT PRIMARY KEY,"
+            " pasta TEXT NOT NULL,"
+            " tamanho INTEGER NOT NULL,"
+            " mtime INTEGER NOT NULL,"
+            " valido INTEGER NOT NULL,"
+            " chave TEXT,"
+            " numero TEXT,"
+            " tipo TEXT,"
+            " complemento INTEGER,"
+            " valor TEXT)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_xml_pasta ON xml (pasta)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+    def carregar(self, pasta: str) -> dict:
+        """
+        Retorna {caminho: (tamanho, mtime, registro)} dos XMLs da pasta.
+        """
+        cursor = self.conn.execute(
+            "SELECT caminho, tamanho, mtime, valido, chave, numero, tipo, complemento, valor"
+            " FROM xml WHERE pasta = ?",
+            (os.path.abspath(pasta),)
+        )
+
+        itens = {}
+        for caminho, tamanho, mtime, valido, chave, numero, tipo, comp, valor in cursor:
+            registro = None
+            if valido:
+                registro = {
+                    "chave": chave,
+                    "numero": numero,
+                    "tipo": tipo,
+                    "complemento": bool(comp),
+                    "valor": Decimal(valor) if valor is not None else None
+                }
+            itens[caminho] = (tamanho, mtime, registro)
+        return itens
+
+    def gravar(self, pasta: str, itens):
+        """
+        Grava uma lista de (caminho, tamanho, mtime, registro).
+        Registro None marca XML inválido, para não ser lido de novo.
+        """
+        pasta = os.path.abspath(pasta)
+        linhas = []
+        for caminho, tamanho, mtime, registro in itens:
+            if registro:
+                valor = registro["valor"]
+                linhas.append((
+                    caminho, pasta, tamanho, mtime, 1,
+                    registro["chave"], registro["numero"], registro["tipo"],
+                    int(registro["complemento"]),
+                    str(valor) if valor is not None else None
+                ))
+            else:
+                linhas.append((caminho, pasta, tamanho, mtime, 0, None, None, None, None, None))
+
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO xml VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            linhas
+        )
+        self.conn.commit()
+
+    def remover(self, caminhos):
+        self.conn.executemany("DELETE FROM xml WHERE caminho = ?", [(c,) for c in caminhos])
+        self.conn.commit()
+
+    def fechar(self):
+        try:
+            self.conn.commit()
+            self.conn.close()
+        except sqlite3.Error:
+            pass
+
+
+# =====================================================
+# CACHE DE LEITURA DE PÁGINAS (CHAVE POR PÁGINA)
+# =====================================================
+
+class CacheBarcode:
+    """
+    Cache persistente (SQLite) da chave lida em cada página de PDF,
+    identificada pelo hash do conteúdo do arquivo e pelo índice da página.
+    O documento pode ser gravado com sufixos "|..." depois do hash (opções
+    de leitura); arquivos guarda só o hash do conteúdo.
+    Páginas sem chave também são guardadas. O total de páginas é limitado:
+    ao passar de max_paginas, os documentos usados há mais tempo saem primeiro.
+    """
+
+    def __init__(self, caminho, max_paginas: int = 500_000):
+        os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+        self.max_paginas = max_paginas
+        self.conn = sqlite3.connect(str(caminho))
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS arquivos ("
+            " id TEXT PRIMARY KEY, tamanho INTEGER NOT NULL, mtime INTEGER NOT NULL, hash TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS documentos ("
+            " hash TEXT PRIMARY KEY, paginas INTEGER, acesso REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS paginas ("
+            " hash TEXT NOT NULL, pagina INTEGER NOT NULL, chave TEXT,"
+            " PRIMARY KEY (hash, pagina));"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+    def hash_conhecido(self, identificador: str, tamanho: int, mtime: int) -> str | None:
+        """
+        Hash já calculado para o arquivo, se tamanho e data não mudaram.
+        """
+        linha = self.conn.execute(
+            "SELECT hash FROM arquivos WHERE id = ? AND tamanho = ? AND mtime = ?",
+            (identificador, tamanho, mtime)
+        ).fetchone()
+        return linha[0] if linha else None
+
+    def gravar_hash(self, identificador: str, tamanho: int, mtime: int, hash_: str):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO arquivos VALUES (?, ?, ?, ?)",
+            (identificador, tamanho, mtime, hash_)
+        )
+
+    def carregar(self, hash_: str) -> dict | None:
+        """
+        Retorna {página: chave ou None} se o documento foi lido por
+        completo em uma execução anterior; caso contrário, None.
+        """
+        linha = self.conn.execute("SELECT paginas FROM documentos WHERE hash = ?", (hash_,)).fetchone()
+        if not linha or linha[0] is None:
+            return None
+
+        paginas = dict(self.conn.execute("SELECT pagina, chave FROM paginas WHERE hash = ?", (hash_,)))
+        if len(paginas) != linha[0]:
+            return None
+
+        self.conn.execute("UPDATE documentos SET acesso = ? WHERE hash = ?", (time(), hash_))
+        return paginas
+
+    def gravar(self, hash_: str, paginas: dict):
+        """
+        Grava o resultado completo de um documento ({página: chave ou None}).
+        """
+        self.conn.execute("DELETE FROM paginas WHERE hash = ?", (hash_,))
+        self.conn.executemany(
+            "INSERT INTO paginas VALUES (?, ?, ?)",
+            [(hash_, pagina, chave) for pagina, chave in paginas.items()]
+        )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO documentos VALUES (?, ?, ?)",
+            (hash_, len(paginas), time())
+        )
+        self.conn.commit()
+
+    def podar(self):
+        """
+        Remove os documentos menos usados até o total de páginas caber no limite.
+        """
+        total = self.conn.execute("SELECT COUNT(*) FROM paginas").fetchone()[0]
+        if total <= self.max_paginas:
+            return
+
+        for hash_, paginas in self.conn.execute(
+            "SELECT hash, paginas FROM documentos ORDER BY acesso"
+        ).fetchall():
+            self.conn.execute("DELETE FROM paginas WHERE hash = ?", (hash_,))
+            self.conn.execute("DELETE FROM documentos WHERE hash = ?", (hash_,))
+            total -= paginas or 0
+            if total <= self.max_paginas:
+                break
+
+        # Hash de arquivo que nenhum documento restante usa (nem com sufixo de opções)
+        self.conn.execute(
+            "DELETE FROM arquivos WHERE NOT EXISTS ("
+            " SELECT 1 FROM documentos d WHERE d.hash = arquivos.hash"
+            " OR (d.hash >= arquivos.hash || '|' AND d.hash < arquivos.hash || '}'))"
+        )
+        self.conn.commit()
+
+    def fechar(self):
+        try:
+            self.podar()
+            self.conn.commit()
+            self.conn.close()
+        except sqlite3.Error:
+            pass
@@ -2,6 +2,48 @@ from json import load, dump
 from pathlib import Path
 
 CONFIG_FILE = Path("config/config.json")
+CACHE_XML = CONFIG_FILE.parent / "cache_xml.sqlite"
+CACHE_BARCODE = CONFIG_FILE.parent / "cache_barcode.sqlite"
+CACHE_PLANILHAS = CONFIG_FILE.parent / "planilhas"
+
+# Opções avançadas do processamento (chave "opcoes" do config.json)
+OPCOES_PADRAO = {
+    "recursivo": False,         # inclui subpastas das pastas de PDF/XML
+    "cache_xml": True,
+    "processos_xml": 0,         # 0 = todos os núcleos, 1 = sem paralelismo
+    "leitura_rapida_xml": True, # lê os campos direto dos bytes quando possível
+    # Faixa do cabeçalho do DACTE com o código de barras da chave, em frações
+    # da página (x0, y0, x1, y1); null renderiza sempre a página inteira
+    "recorte_barcode": [0.45, 0.0, 1.0, 0.2],
+    "chave_por_texto": True,    # tenta a camada de texto do PDF antes do código de barras
+    "processos_paginas": 0,     # leitura das páginas: 0 = todos os núcleos, 1 = sem paralelismo
+    "cache_barcode": True,      # guarda a chave lida em cada página (por hash do PDF)
+    "cache_barcode_max_paginas": 500000,
+    # PDF unificado dividido em volumes para não acumular o lote inteiro na
+    # memória; 0 = sem limite
+    "pdf_unico_max_paginas": 1000,
+    "pdf_unico_max_mb": 0,
+    "motor_carimbo": "pypdf",   # "pypdf" (PyPDF2) ou "pymupdf" (escreve direto na página)
+    "processos_carimbo": 0,     # carimbo/gravação dos PDFs: 0 = todos os núcleos, 1 = sem paralelismo
+    # Distribui o vTPrest proporcionalmente às linhas da planilha (soma exata);
+    # False = usa os valores da planilha e só acerta diferenças de 1 centavo
+    "rateio_proporcional": True,
+    # Diferenças maiores que isto (em centavos) são rateadas, mas geram aviso no
+    # log e ficam marcadas no relatório
+    "rateio_tolerancia_centavos": 1,
+    "motor_planilha": "auto",   # engine do read_excel: "auto" usa o calamine se instalado
+    "cache_planilha": True,     # guarda as colunas lidas em parquet (requer pyarrow)
+    # Leitura em blocos para arquivos muito grandes: cada CT-e é rateado e
+    # carimbado ao sair do arquivo, que precisa estar ordenado/agrupado por
+    # N° CT-e (desativa o pipeline)
+    "planilha_em_blocos": False,
+    "linhas_por_bloco": 50000,
+    "csv_separador": ";",       # planilhas .csv/.txt
+    "csv_encoding": "utf-8-sig",
+    # Fases sobrepostas: planilha lida junto com os XMLs e cada CT-e carimbado
+    # assim que a página é encontrada, sem esperar a leitura de todos os PDFs
+    "pipeline": False,
+}
 
 def carregar_config():
 
@@ -15,3 +57,15 @@ def salvar_config(dados: dict):
     CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
     with open(CONFIG_FILE, "w", encoding="utf-8") as f:
         dump(dados, f, indent=4, ensure_ascii=False)
+
+
+def carregar_opcoes(cfg: dict | None = None):
+    """
+    Retorna as opções avançadas, completando com os valores padrão.
+    """
+    if cfg is None:
+        cfg = carregar_config()
+
+    opcoes = dict(OPCOES_PADRAO)
+    opcoes.update(cfg.get("opcoes", {}))
+    return opcoes
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from decimal import Decimal
+
+from .arquivos import Inventario
+
+
+NOME_DIARIO = "rateio_andamento.jsonl"
+
+# Opções que mudam o conteúdo dos PDFs gerados: com outro valor, não retoma
+OPCOES_ASSINATURA = ("rateio_proporcional", "motor_carimbo", "recursivo")
+
+
+# =====================================================
+# DIÁRIO DE EXECUÇÃO (RETOMADA)
+# =====================================================
+
+def assinatura_entradas(planilha, pasta_pdfs, pasta_xml, opcoes=None, inventario=None) -> str:
+    """
+    Identifica as entradas de uma execução: planilha (caminho, tamanho e
+    mtime), pastas de PDF e XML, os PDFs (id, tamanho e mtime) e as opções
+    de OPCOES_ASSINATURA. Os XMLs ficam de fora: mover_xml os tira da
+    pasta a cada CT-e gravado, e o diário já guarda os valores de cada um.
+    Sem inventario, a pasta de PDFs é listada aqui (como no processamento).
+    """
+    opcoes = opcoes or {}
+    try:
+        st = os.stat(planilha)
+        tamanho, mtime = st.st_size, st.st_mtime_ns
+    except OSError:
+        tamanho = mtime = None
+    if inventario is None:
+        inventario = Inventario([pasta_pdfs], (".pdf",), recursivo=opcoes.get("recursivo", False))
+
+    partes = [
+        os.path.abspath(planilha), tamanho, mtime,
+        os.path.abspath(pasta_pdfs) if pasta_pdfs else "",
+        os.path.abspath(pasta_xml) if pasta_xml else "",
+        *(opcoes.get(nome) for nome in OPCOES_ASSINATURA),
+    ]
+    h = hashlib.blake2b(json.dumps(partes, default=str).encode("utf-8"), digest_size=16)
+    entradas = inventario.listar(pasta_pdfs, ".pdf") if pasta_pdfs else []
+    for e in sorted(entradas, key=lambda e: e.id):
+        h.update(f"\n{e.id}|{e.tamanho}|{e.mtime}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def ler_diario(pasta_saida) -> list[dict]:
+    """Eventos do diário da pasta; uma última linha incompleta (queda do programa) é ignorada"""
+    caminho = os.path.join(pasta_saida, NOME_DIARIO)
+    eventos = []
+    try:
+        with open(caminho, "r", encoding="utf-8") as f:
+            for linha in f:
+                try:
+                    eventos.append(json.loads(linha))
+                except ValueError:
+                    break
+    except OSError:
+        pass
+    return eventos
+
+
+def _estado(eventos, assinatura):
+    """(fases, concluídos) da execução registrada, ou None se não há o que retomar"""
+    if not eventos or eventos[0].get("evento") != "inicio" or eventos[0].get("assinatura") != assinatura:
+        return None
+    if eventos[-1].get("evento") == "fim":
+        return None
+
+    fases = {}
+    concluidos = {}
+    for evento in eventos:
+        if evento.get("evento") == "fase":
+            fases[evento["fase"]] = evento
+        elif evento.get("evento") == "cte":
+            concluidos[evento["ncte"]] = evento
+    return fases, concluidos
+
+
+def ha_execucao_pendente(pasta_saida) -> bool:
+    """
+    Se há na pasta um diário de execução não terminada (de qualquer
+    entrada). Não lista as pastas de entrada: serve para decidir se vale
+    calcular a assinatura.
+    """
+    eventos = ler_diario(pasta_saida)
+    return bool(eventos) and eventos[0].get("evento") == "inicio" and eventos[-1].get("evento") != "fim"
+
+
+def execucao_pendente(pasta_saida, assinatura) -> int | None:
+    """
+    Quantos CT-es a execução interrompida com as mesmas entradas já
+    gravou (None se não há execução para retomar).
+    """
+    estado = _estado(ler_diario(pasta_saida), assinatura)
+    return None if estado is None else len(estado[1])
+
+
+class DiarioExecucao:
+    """
+    Diário (JSON lines, só acrescenta) da execução em pasta_saida: fases
+    concluídas e cada CT-e gravado, com arquivo e valores. Com retomar e a
+    mesma assinatura, continua o diário anterior e expõe o que já foi feito;
+    sem isso, começa um diário novo, que só substitui o anterior quando a
+    execução registra o primeiro evento depois do início. Falhas de gravação
+    não interrompem o processamento (o diário fica desativado e o motivo em erro).
+    """
+
+    def __init__(self, pasta_saida, assinatura, retomar=False):
+        self.pasta = pasta_saida
+        self.caminho = os.path.join(pasta_saida, NOME_DIARIO)
+        self.fases = {}
+        self.concluidos = {}
+        self.retomado = False
+        self.erro = None
+        self._arquivo = None
+        self._inicio = None
+
+        estado = _estado(ler_diario(pasta_saida), assinatura) if retomar else None
+        if estado is not None:
+            self.fases, self.concluidos = estado
+            self.retomado = True
+            self._abrir()
+            self._registrar("retomada", assinatura=assinatura)
+        else:
+            # Diário novo: o anterior (talvez ainda pendente) fica até o primeiro evento
+            self._inicio = self._linha("inicio", assinatura=assinatura)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+    @staticmethod
+    def _linha(evento, **dados):
+        return json.dumps({"evento": evento, "hora": datetime.now().isoformat(timespec="seconds"), **dados},
+                          ensure_ascii=False, default=str) + "\n"
+
+    def _abrir(self):
+        try:
+            self._arquivo = open(self.caminho, "a", encoding="utf-8")
+        except OSError as e:
+            self.erro = e
+
+    def _substituir(self):
+        """Troca o diário anterior pelo novo, já com a linha de início"""
+        inicio, self._inicio = self._inicio, None
+        temporario = self.caminho + ".novo"
+        try:
+            with open(temporario, "w", encoding="utf-8") as f:
+                f.write(inicio)
+            os.replace(temporario, self.caminho)
+        except OSError as e:
+            self.erro = e
+            return
+        self._abrir()
+
+    def _registrar(self, evento, **dados):
+        if self._inicio is not None:
+            self._substituir()
+        if self._arquivo is None:
+            return
+        try:
+            self._arquivo.write(self._linha(evento, **dados))
+            self._arquivo.flush()
+        except (OSError, ValueError) as e:
+            self.erro = e
+            self.fechar()
+
+    def registrar_fase(self, fase, **dados):
+        self._registrar("fase", fase=fase, **dados)
+
+    @staticmethod
+    def _resumo_chaves(chaves):
+        return hashlib.blake2b("|".join(sorted(chaves)).encode("utf-8"), digest_size=16).hexdigest()
+
+    def registrar_paginas(self, arquivos_pdf, chaves, paginas):
+        """
+        Fase de leitura dos PDFs: entradas lidas, chaves procuradas e
+        {chave: (entrada, índice)} encontradas.
+        """
+        self.registrar_fase(
+            "pdf",
+            arquivos=[[e.id, e.tamanho, e.mtime] for e in arquivos_pdf],
+            chaves=self._resumo_chaves(chaves),
+            paginas={chave: [entrada.id, i] for chave, (entrada, i) in paginas.items()},
+        )
+
+    def paginas_salvas(self, arquivos_pdf, chaves):
+        """
+        {chave: (Entrada, índice)} da leitura registrada, se os PDFs (caminho,
+        tamanho e mtime) e as chaves procuradas são os mesmos; senão None.
+        """
+        fase = self.fases.get("pdf")
+        atuais = [[e.id, e.tamanho, e.mtime] for e in arquivos_pdf]
+        if not fase or fase.get("chaves") != self._resumo_chaves(chaves) or fase["arquivos"] != atuais:
+            return None
+        por_id = {e.id: e for e in arquivos_pdf}
+        return {chave: (por_id[identificador], i) for chave, (identificador, i) in fase["paginas"].items()}
+
+    def registrar_cte(self, ncte, arquivo, tamanho, valor_xml, valor_planilha, linhas,
+                      status="Sucesso", mensagem="Processado com Sucesso!"):
+        self._registrar("cte", ncte=ncte, arquivo=arquivo, tamanho=tamanho,
+                        valor_xml=valor_xml, valor_planilha=valor_planilha,
+                        linhas=[list(linha) for linha in linhas],
+                        status=status, mensagem=mensagem)
+
+    def concluido(self, ncte):
+        """
+        Registro do CT-e já gravado (com Decimal nos valores), se o PDF
+        continua na pasta com o mesmo tamanho; senão None.
+        """
+        registro = self.concluidos.get(ncte)
+        if not registro:
+            return None
+        try:
+            if os.path.getsize(os.path.join(self.pasta, registro["arquivo"])) != registro["tamanho"]:
+                return None
+        except OSError:
+            return None
+        return {
+            **registro,
+            "valor_xml": Decimal(registro["valor_xml"]) if registro["valor_xml"] else 0,
+            "valor_planilha": Decimal(registro["valor_planilha"]),
+        }
+
+    def finalizar(self):
+        """Marca a execução como terminada (não será oferecida para retomar)"""
+        self._registrar("fim")
+        self.fechar()
+
+    def fechar(self):
+        if self._arquivo is not None:
+            try:
+                self._arquivo.close()
+            except OSError:
+                pass
+            self._arquivo = None
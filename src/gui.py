@@ -8,6 +8,8 @@ from datetime import datetime
 # Importações do backend
 from .rateio import processar
 from . import config as cfg_mod
+from .arquivos import Inventario
+from .diario import assinatura_entradas, execucao_pendente, ha_execucao_pendente
 from .generalsutils import plan_aberta
 
 # =====================================================
@@ -235,15 +237,17 @@ class RateioGUI:
         self.v_saida.set(cfg.get("saida", ""))
 
     def _salvar_config_gui(self):
-        cfg_mod.salvar_config({
+        cfg = cfg_mod.carregar_config()
+        cfg.update({
             "planilha": self.v_planilha.get(),
             "pdfs": self.v_pdfs.get(),
             "xml": self.v_xml.get(),
             "saida": self.v_saida.get()
         })
+        cfg_mod.salvar_config(cfg)
 
     def sel_planilha(self):
-        f = filedialog.askopenfilename(title="Selecionar Planilha", filetypes=[("Excel", "*.xlsx *.xls")])
+        f = filedialog.askopenfilename(title="Selecionar Planilha", filetypes=[("Excel", "*.xlsx *.xls"), ("CSV", "*.csv *.txt")])
         if f: self.v_planilha.set(f)
 
     def sel_pdfs(self):
@@ -282,7 +286,7 @@ class RateioGUI:
             messagebox.showerror(f'Arquivo Bloqueado!\nA planilha {os.path.basename(planilha)} pode estar aberta em algum computador')
 
             return
-        
+
         try: 
             pasta_saida = self.v_saida.get()
             timestamp = datetime.now().strftime('%d-%m-%Y - %H-%M-%S')
@@ -313,9 +317,50 @@ class RateioGUI:
 
         threading.Thread(target=self._processar_thread, daemon=True).start()
 
+    def _perguntar(self, titulo, texto):
+        """messagebox.askyesno na thread da interface, a partir da thread de processamento"""
+        resposta = {}
+        pronto = threading.Event()
+
+        def perguntar():
+            resposta["sim"] = messagebox.askyesno(titulo, texto)
+            pronto.set()
+
+        self.root.after(0, perguntar)
+        pronto.wait()
+        return resposta.get("sim", False)
+
+    def _conferir_retomada(self, opcoes):
+        """
+        (retomar, inventário) da execução: só com um diário pendente na
+        pasta de saída as entradas são listadas e comparadas; o mesmo
+        inventário segue para o processar.
+        """
+        if not ha_execucao_pendente(self.v_saida.get()):
+            return False, None
+
+        self.atualizar_status_fase("Conferindo execução interrompida")
+        inventario = Inventario(
+            [self.v_xml.get(), self.v_pdfs.get()],
+            recursivo=opcoes.get("recursivo", False)
+        )
+        assinatura = assinatura_entradas(self.v_planilha.get(), self.v_pdfs.get(), self.v_xml.get(),
+                                         opcoes, inventario)
+        pendente = execucao_pendente(self.v_saida.get(), assinatura)
+        if pendente is None:
+            return False, inventario
+        retomar = self._perguntar(
+            "Retomar processamento",
+            f"Há uma execução interrompida destas mesmas entradas, com {pendente} CT-e(s) já gravado(s).\n"
+            "Deseja continuar de onde parou?"
+        )
+        return retomar, inventario
+
     def _processar_thread(self):
         self.tempo_inicial = time()
         try:
+            opcoes = cfg_mod.carregar_opcoes()
+            retomar, inventario = self._conferir_retomada(opcoes)
             processar(
                 planilha=self.v_planilha.get(),
                 pasta_pdfs=self.v_pdfs.get(),
@@ -326,7 +371,10 @@ class RateioGUI:
                 logger_func=self.log_msg,              
                 status_func=self.atualizar_status_fase, 
                 progresso=self.progress_adapter,
-                stop_event=self.stop_event
+                stop_event=self.stop_event,
+                opcoes=opcoes,
+                retomar=retomar,
+                inventario=inventario
             )
         except Exception as e:
             self.log_msg(f"ERRO FATAL: {e}", tag="erro")
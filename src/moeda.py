@@ -0,0 +1,120 @@
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import chain
+
+import numpy as np
+
+
+# =====================================================
+# VALORES EM CENTAVOS
+# =====================================================
+
+def para_centavos(valor) -> int:
+    """Decimal/str/int em reais -> centavos inteiros (ROUND_HALF_UP, como o quantize)"""
+    return int((Decimal(str(valor)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def de_centavos(centavos: int) -> Decimal:
+    """Centavos inteiros -> Decimal com duas casas"""
+    return Decimal(int(centavos)).scaleb(-2)
+
+
+def formato_centavos(centavos: int) -> str:
+    """Mesmo formato do formato_brl (1.234,56), direto dos centavos"""
+    centavos = int(centavos)
+    if 0 <= centavos < 100_000:
+        return f"{centavos // 100},{centavos % 100:02d}"
+    sinal = "-" if centavos < 0 else ""
+    reais, cent = divmod(abs(centavos), 100)
+    return f"{sinal}{reais:,}".replace(",", ".") + f",{cent:02d}"
+
+
+# =====================================================
+# RATEIO (MAIORES RESTOS)
+# =====================================================
+
+def ratear(total: int, pesos) -> list[int]:
+    """
+    Divide total (centavos) proporcionalmente aos pesos pelo método dos
+    maiores restos: cada parte recebe o piso da sua cota e os centavos que
+    sobram vão para as maiores frações (empate: a linha que vem antes).
+    A soma das partes é sempre igual a total.
+    """
+    pesos = [int(p) for p in pesos]
+    soma = sum(pesos)
+    if not pesos or soma <= 0 or any(p < 0 for p in pesos):
+        raise ValueError("pesos do rateio devem ser não negativos e somar mais que zero")
+
+    sinal = -1 if total < 0 else 1
+    total = abs(int(total))
+
+    partes = []
+    restos = []
+    for i, p in enumerate(pesos):
+        parte, resto = divmod(total * p, soma)
+        partes.append(parte)
+        restos.append((-resto, i))
+
+    sobra = total - sum(partes)
+    for _, i in sorted(restos)[:sobra]:
+        partes[i] += 1
+    return [sinal * p for p in partes]
+
+
+def ratear_lote(totais, pesos, inicios):
+    """
+    Versão em lote do ratear: pesos é o vetor de todas as linhas, com os
+    grupos contíguos começando nos índices de inicios, e totais tem um
+    valor (centavos) por grupo. Devolve o vetor de partes, na ordem das linhas.
+    """
+    totais = np.asarray(totais, dtype=np.int64)
+    pesos = np.asarray(pesos, dtype=np.int64)
+    inicios = np.asarray(inicios, dtype=np.int64)
+    if not len(pesos):
+        return pesos.copy()
+
+    tamanhos = np.diff(np.r_[inicios, len(pesos)])
+    grupo = np.repeat(np.arange(len(inicios)), tamanhos)
+
+    somas = np.add.reduceat(pesos, inicios)
+    if (somas <= 0).any() or (pesos < 0).any():
+        raise ValueError("pesos do rateio devem ser não negativos e somar mais que zero")
+
+    sinais = np.where(totais < 0, -1, 1)
+    absolutos = np.abs(totais)
+
+    # total * peso cabe em int64 para qualquer valor realista; se não couber,
+    # cai para inteiros do Python (lento, mas exato)
+    if int(absolutos.max(initial=0)) * int(pesos.max(initial=0)) >= 2 ** 63:
+        partes = [
+            ratear(int(t), pesos[a:b])
+            for t, a, b in zip(totais, inicios, np.r_[inicios[1:], len(pesos)])
+        ]
+        return np.array([p for grupo_partes in partes for p in grupo_partes], dtype=object)
+
+    produto = absolutos[grupo] * pesos
+    partes, restos = np.divmod(produto, somas[grupo])
+
+    # Posição de cada linha no seu grupo, ordenando por resto decrescente
+    # (lexsort é estável, então no empate vence a linha que vem antes)
+    ordem = np.lexsort((-restos, grupo))
+    posicao = np.empty_like(ordem)
+    posicao[ordem] = np.arange(len(ordem)) - inicios[grupo[ordem]]
+
+    sobras = absolutos - np.add.reduceat(partes, inicios)
+    partes += posicao < sobras[grupo]
+    return partes * sinais[grupo]
+
+
+def ratear_grupos(totais, grupos):
+    """
+    ratear_lote a partir de uma lista de grupos (listas de pesos),
+    devolvendo uma lista de partes (int) por grupo.
+    """
+    if not grupos:
+        return []
+    tamanhos = np.fromiter(map(len, grupos), dtype=np.int64, count=len(grupos))
+    pesos = np.fromiter(chain.from_iterable(grupos), dtype=np.int64, count=int(tamanhos.sum()))
+    fins = np.cumsum(tamanhos)
+    inicios = fins - tamanhos
+    partes = ratear_lote(totais, pesos, inicios).tolist()
+    return [partes[a:b] for a, b in zip(inicios.tolist(), fins.tolist())]
@@ -1,15 +1,21 @@
 import os
 import fitz  # PyMuPDF
 from PIL import Image
-from pyzbar.pyzbar import decode
-from PyPDF2 import PdfReader, PdfWriter
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
+from PyPDF2 import PageObject, PdfReader, PdfWriter
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
+import ctypes
 import io
+import queue
 import re
 import sys
 import subprocess
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from typing import NamedTuple
 
+from .arquivos import Entrada, chave_no_nome, hash_conteudo, ler_bytes
+from .xml_utils import chave_cte, processos_pool
 
 
 if sys.platform == "win32":
@@ -37,39 +43,207 @@ if sys.platform == "win32":
     subprocess.Popen = PopenSemJanela
 
 
-def renderizar_paginas(pdf_path, numero_pag_base):
-    try:
-        doc = fitz.open(pdf_path)
+def _abrir_fitz(pdf):
+    """
+    Abre no PyMuPDF um caminho ou o conteúdo já em memória (bytes).
+    """
+    if isinstance(pdf, (bytes, bytearray)):
+        return fitz.open(stream=pdf, filetype="pdf")
+    return fitz.open(pdf)
+
+
+ZOOM_PADRAO = 3
+
+
+def _retangulo_recorte(page, recorte):
+    """
+    Converte o recorte (x0, y0, x1, y1), em frações da página, para um fitz.Rect.
+    """
+    r = page.rect
+    x0, y0, x1, y1 = recorte
+    return fitz.Rect(
+        r.x0 + x0 * r.width, r.y0 + y0 * r.height,
+        r.x0 + x1 * r.width, r.y0 + y1 * r.height
+    )
+
+
+class RasterPagina(NamedTuple):
+    """
+    Página renderizada em tons de cinza, 8 bits por pixel, sem compressão.
+    Os pixels apontam para a memória do próprio Pixmap (sem cópia), que fica
+    referenciado em `pixmap` enquanto o raster existir.
+    """
+    pixels: object
+    largura: int
+    altura: int
+    pixmap: object = None
+
+    def para_pyzbar(self):
+        """Formato (pixels, largura, altura) aceito pelo pyzbar.decode."""
+        return (self.pixels, self.largura, self.altura)
+
+    def para_imagem(self) -> Image.Image:
+        return Image.frombuffer("L", (self.largura, self.altura), self.pixels, "raw", "L", 0, 1)
+
+
+def _renderizar_pagina(page, zoom=ZOOM_PADRAO, recorte=None) -> RasterPagina:
+    clip = _retangulo_recorte(page, recorte) if recorte else None
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, colorspace=fitz.csGRAY, alpha=False)
+    dados = pix.samples_mv
+
+    if pix.stride == pix.width:
+        # O pyzbar repassa os pixels ao zbar via ctypes.cast, que não aceita
+        # memoryview; o array ctypes sobre o mesmo buffer evita a cópia.
+        pixels = (ctypes.c_ubyte * len(dados)).from_buffer(dados)
+        return RasterPagina(pixels, pix.width, pix.height, pix)
+
+    # Linhas com preenchimento: remove o excesso de cada linha
+    pixels = b"".join(dados[y * pix.stride:y * pix.stride + pix.width] for y in range(pix.height))
+    return RasterPagina(pixels, pix.width, pix.height)
+
+
+class DocumentoPDF:
+    """
+    PDF de entrada aberto uma única vez no PyMuPDF (renderização) e,
+    sob demanda, no PyPDF2 (cópia das páginas).
+    Aceita caminho, bytes ou Entrada (membros de ZIP são lidos para a memória).
+    """
+
+    def __init__(self, origem):
+        if isinstance(origem, Entrada):
+            self.nome = origem.nome
+            origem = ler_bytes(origem) if origem.membro else origem.caminho
+        else:
+            self.nome = os.path.basename(origem) if isinstance(origem, str) else "PDF"
+
+        self.origem = origem
+        self.doc = _abrir_fitz(origem)
+        self._reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+    def __len__(self):
+        return len(self.doc)
+
+    @property
+    def reader(self) -> PdfReader:
+        if self._reader is None:
+            if isinstance(self.origem, (bytes, bytearray)):
+                self._reader = PdfReader(io.BytesIO(self.origem))
+            else:
+                self._reader = PdfReader(self.origem)
+        return self._reader
 
-        page_index = numero_pag_base - 1
+    def renderizar(self, indice, zoom=ZOOM_PADRAO, recorte=None):
+        return _renderizar_pagina(self.doc.load_page(indice), zoom, recorte)
 
-        if page_index < 0 or page_index >= len(doc):
+    def ler_chave_texto(self, indice, recorte=None):
+        """
+        Procura a chave impressa na camada de texto da página (dentro do
+        recorte, se informado). Só aceita um resultado sem ambiguidade.
+        """
+        page = self.doc.load_page(indice)
+        clip = _retangulo_recorte(page, recorte) if recorte else None
+        return extrair_chave_texto(page.get_text("text", clip=clip))
+
+    def ler_chave(self, indice, recorte=None, log=print, contadores=None):
+        """
+        Lê a chave do código de barras da página. Com recorte, renderiza
+        só a faixa do código e decodifica apenas CODE-128; se nada for
+        encontrado, repete com a página inteira.
+        contadores (dict) acumula o tamanho dos rasters gerados.
+        Sem pyzbar/libzbar, não renderiza nada e retorna None (só texto).
+        """
+        pyzbar = _pyzbar(log)
+        if pyzbar is None:
             return None
-        
-        page = doc.load_page(page_index)
 
-        zoom = 3
-        
-        mat = fitz.Matrix(zoom, zoom)
+        tentativas = [(recorte, [pyzbar.ZBarSymbol.CODE128])] if recorte else []
+        tentativas.append((None, None))
+
+        for area, simbologias in tentativas:
+            try:
+                raster = self.renderizar(indice, recorte=area)
+            except Exception as e:
+                if log:
+                    log(f"❌ Erro PyMuPDF na página {indice + 1} de {self.nome}: {e}")
+                continue
+
+            if contadores is not None:
+                tamanho = len(raster.pixels)
+                contadores["raster_bytes"] = contadores.get("raster_bytes", 0) + tamanho
+                contadores["raster_qtd"] = contadores.get("raster_qtd", 0) + 1
+                contadores["raster_pico"] = max(contadores.get("raster_pico", 0), tamanho)
 
-        pix = page.get_pixmap(matrix = mat)
+            chave = extrair_chave_barcode(raster, log, simbologias)
+            del raster
 
-        img_data = pix.tobytes('png')
-        img_pil = Image.open(io.BytesIO(img_data))
+            if chave:
+                return chave
+        return None
+
+    def fechar(self):
+        self.doc.close()
+        self._reader = None
 
-        doc.close()
-        return img_pil
+
+def renderizar_paginas(pdf_path, numero_pag_base):
+    """
+    Renderiza uma única página (1-based). Abre o arquivo a cada chamada;
+    para várias páginas do mesmo PDF use DocumentoPDF.renderizar.
+    """
+    try:
+        with DocumentoPDF(pdf_path) as doc:
+            page_index = numero_pag_base - 1
+
+            if page_index < 0 or page_index >= len(doc):
+                return None
+
+            return doc.renderizar(page_index).para_imagem()
     except Exception as e:
         print(f'Erro PymuPDF {e}')
         return None
     
 
-def extrair_chave_barcode(img_pil, log_func = print):
+# pyzbar (e a libzbar) só é carregado quando a camada de texto não basta
+_pyzbar_carregado = {}
+
+
+def _pyzbar(log=print):
+    """
+    Módulo pyzbar.pyzbar, importado uma única vez por processo; None se ele
+    ou a libzbar não estiver disponível (a falha é registrada só na primeira
+    vez, e a leitura segue apenas pela camada de texto).
+    """
+    if "modulo" not in _pyzbar_carregado:
+        try:
+            from pyzbar import pyzbar
+        except Exception as e:  # ImportError, ou OSError quando falta a libzbar
+            pyzbar = None
+            if log:
+                log(f"❌ Leitura de código de barras indisponível (pyzbar/libzbar): {e}. "
+                    "As chaves serão lidas só pela camada de texto dos PDFs.")
+        _pyzbar_carregado["modulo"] = pyzbar
+    return _pyzbar_carregado["modulo"]
+
+
+def extrair_chave_barcode(img_pil, log_func = print, simbologias = None):
 
     if img_pil is None: return None
 
+    pyzbar = _pyzbar(log_func)
+    if pyzbar is None:
+        return None
+
+    if isinstance(img_pil, RasterPagina):
+        img_pil = img_pil.para_pyzbar()
+
     try: 
-        codigos = decode(img_pil)
+        codigos = pyzbar.decode(img_pil, symbols=simbologias)
 
         for code in codigos: 
             dados = code.data.decode('utf-8')
@@ -81,86 +255,868 @@ def extrair_chave_barcode(img_pil, log_func = print):
         pass
     return None
 
-def split_pdf_por_cte(pdf_entrada, pasta_saida, mapa_chaves, log, status_callback=None, stop_event=None):
+# 44 dígitos, admitindo um separador simples entre eles (ex.: "3524 0112 ...")
+_RE_CHAVE_TEXTO = re.compile(r"(?<!\d)(?:\d[ .\-/]?){43}\d(?!\d)")
+
+
+def extrair_chave_texto(texto: str):
     """
-    Divide o PDF usando Lazy Loading (processa uma página por vez).
+    Retorna a chave CT-e encontrada no texto; None se não houver
+    nenhuma ou se houver mais de uma chave diferente.
     """
-    os.makedirs(pasta_saida, exist_ok=True)
-    nome_pdf = os.path.basename(pdf_entrada)
-    
-    if status_callback:
-        status_callback(f"Abrindo PDF: {nome_pdf}...")
+    if not texto:
+        return None
+
+    chaves = set()
+    for achado in _RE_CHAVE_TEXTO.finditer(texto):
+        chave = re.sub(r"\D", "", achado.group(0))
+        if chave_cte(chave):
+            chaves.add(chave)
+
+    return chaves.pop() if len(chaves) == 1 else None
+
 
+def _ler_chave_pagina(doc, indice, recorte, usar_texto, contadores, log=print):
+    """
+    Lê a chave da página: camada de texto primeiro (se usar_texto) e,
+    sem resultado, código de barras. Atualiza os contadores por caminho.
+    """
+    chave = doc.ler_chave_texto(indice, recorte) if usar_texto else None
+    if chave:
+        via = "texto"
+    else:
+        chave = doc.ler_chave(indice, recorte, log, contadores)
+        via = "barcode" if chave else "sem_chave"
+    contadores[via] = contadores.get(via, 0) + 1
+    return chave
+
+
+def _somar_contadores(destino, origem):
+    for nome, valor in origem.items():
+        if nome == "raster_pico":
+            destino[nome] = max(destino.get(nome, 0), valor)
+        else:
+            destino[nome] = destino.get(nome, 0) + valor
+
+
+# Documento mantido aberto por cada processo auxiliar da leitura paralela
+_doc_processo = {}
+
+
+def _documento_do_processo(origem) -> DocumentoPDF:
+    identificador = origem.id if isinstance(origem, Entrada) else origem
+    if _doc_processo.get("id") != identificador:
+        anterior = _doc_processo.pop("doc", None)
+        if anterior:
+            anterior.fechar()
+        _doc_processo["doc"] = DocumentoPDF(origem)
+        _doc_processo["id"] = identificador
+    return _doc_processo["doc"]
+
+
+def _escanear_intervalo(origem, inicio, fim, recorte, usar_texto):
+    """
+    Executado nos processos auxiliares: lê as chaves das páginas
+    [inicio, fim) e retorna (total_paginas, [(indice, chave)], contadores, erro).
+    """
+    contadores = {}
     try:
-        reader = PdfReader(pdf_entrada)
-        total_paginas = len(reader.pages)
+        doc = _documento_do_processo(origem)
+        total = len(doc)
+        fim = total if fim is None else min(fim, total)
+        # Sem log aqui: a falta do pyzbar é avisada pelo processo principal
+        resultados = [
+            (i, _ler_chave_pagina(doc, i, recorte, usar_texto, contadores, log=None))
+            for i in range(inicio, fim)
+        ]
+        return total, resultados, contadores, None
     except Exception as e:
-        log(f"❌ Erro leitura PDF {nome_pdf}: {e}")
+        return 0, [], contadores, str(e)
+
+
+def _tarefas_escaneamento(entradas, paginas_por_tarefa, limite_arquivo_pequeno):
+    """
+    Arquivos pequenos viram uma única tarefa; os maiores são divididos em
+    intervalos de páginas (o total é obtido abrindo o arquivo uma vez).
+    """
+    for entrada in entradas:
+        try:
+            tamanho = entrada.tamanho if isinstance(entrada, Entrada) else os.path.getsize(entrada)
+        except OSError:
+            tamanho = 0
+        if tamanho < limite_arquivo_pequeno:
+            yield entrada, 0, None
+            continue
+
+        try:
+            with DocumentoPDF(entrada) as doc:
+                total = len(doc)
+        except Exception:
+            yield entrada, 0, None
+            continue
+
+        for inicio in range(0, max(total, 1), paginas_por_tarefa):
+            yield entrada, inicio, inicio + paginas_por_tarefa
+
+
+def _chave_cache(hash_, recorte, usar_texto):
+    """Documento no cache: hash do conteúdo + opções que mudam o resultado da leitura"""
+    return f"{hash_}|{list(recorte) if recorte else None}|{int(bool(usar_texto))}"
+
+
+def _hash_pdf(cache, entrada):
+    if isinstance(entrada, Entrada):
+        identificador, tamanho, mtime = entrada.id, entrada.tamanho, entrada.mtime
+    else:
+        st = os.stat(entrada)
+        identificador, tamanho, mtime = os.path.abspath(entrada), st.st_size, st.st_mtime_ns
+
+    hash_ = cache.hash_conhecido(identificador, tamanho, mtime)
+    if hash_ is None:
+        hash_ = hash_conteudo(entrada)
+        cache.gravar_hash(identificador, tamanho, mtime, hash_)
+    return hash_
+
+
+def escanear_paginas(entradas, log=print, status_callback=None, stop_event=None,
+                     recorte=None, usar_texto=True, contadores=None,
+                     processos: int = 1, paginas_por_tarefa: int = 8,
+                     limite_arquivo_pequeno: int = 2 * 1024 * 1024, cache=None):
+    """
+    Lê a chave de cada página dos PDFs, gerando (entrada, índice, chave)
+    na ordem dos arquivos e das páginas.
+    Com processos != 1 (0 = todos os núcleos), intervalos de páginas são
+    distribuídos entre processos que mantêm o próprio documento aberto;
+    os resultados voltam ao processo principal em ordem.
+    Com um CacheBarcode, documentos já lidos (mesmo conteúdo) não são
+    renderizados de novo e os novos resultados são gravados no cache.
+    """
+    if contadores is None:
+        contadores = {}
+    totais = {}
+
+    def ler(pendentes):
+        return _escanear_sem_cache(
+            pendentes, log, status_callback, stop_event, recorte, usar_texto,
+            contadores, processos, paginas_por_tarefa, limite_arquivo_pequeno, totais
+        )
+
+    if cache is None:
+        yield from ler(entradas)
         return
 
-    for i in range(total_paginas):
+    entradas = list(entradas)
+    if status_callback:
+        status_callback("Verificando PDFs já lidos...")
+
+    hashes = []
+    salvos = []
+    for entrada in entradas:
+        if stop_event and stop_event.is_set():
+            return
+        try:
+            hash_ = _chave_cache(_hash_pdf(cache, entrada), recorte, usar_texto)
+            salvos.append(cache.carregar(hash_))
+        except Exception:
+            hash_ = None
+            salvos.append(None)
+        hashes.append(hash_)
+
+    leitura = ler([e for e, salvo in zip(entradas, salvos) if salvo is None])
+    proximo = next(leitura, None)
+
+    for entrada, hash_, salvo in zip(entradas, hashes, salvos):
         if stop_event and stop_event.is_set():
-            if status_callback: status_callback("Interrompendo leitura...")
             return
 
-        numero_real = i + 1
-        
-        if status_callback:
-            status_callback(f"Lendo página {numero_real} de {total_paginas}.")
-
-        imagem = renderizar_paginas(pdf_entrada, numero_real)
-        chave = extrair_chave_barcode(imagem, log)
-        
-        if imagem:
-            imagem.close()
-            del imagem 
-
-        if chave and chave in mapa_chaves:
-            destino = os.path.join(pasta_saida, f"{chave}-procCTe.pdf")
-            if os.path.exists(destino):
+        if salvo is not None:
+            contadores["cache"] = contadores.get("cache", 0) + len(salvo)
+            for i in sorted(salvo):
+                yield entrada, i, salvo[i]
+            continue
+
+        lidas = {}
+        while proximo is not None and proximo[0] is entrada:
+            lidas[proximo[1]] = proximo[2]
+            yield proximo
+            proximo = next(leitura, None)
+
+        # Só a leitura completa vai para o cache: um intervalo que falhou
+        # deixaria páginas faltando que nunca mais seriam lidas
+        if (hash_ and lidas and len(lidas) == totais.get(entrada)
+                and not (stop_event and stop_event.is_set())):
+            cache.gravar(hash_, lidas)
+
+
+def _escanear_sem_cache(entradas, log, status_callback, stop_event, recorte, usar_texto,
+                        contadores, processos, paginas_por_tarefa, limite_arquivo_pequeno,
+                        totais=None):
+    """totais (dict), se informado, recebe o número de páginas de cada entrada lida"""
+    if totais is None:
+        totais = {}
+
+    processos = processos_pool(processos)
+
+    def nome_de(entrada):
+        return entrada.nome if isinstance(entrada, Entrada) else os.path.basename(str(entrada))
+
+    if processos == 1:
+        for entrada in entradas:
+            if stop_event and stop_event.is_set():
+                return
+
+            if status_callback:
+                status_callback(f"Abrindo PDF: {nome_de(entrada)}...")
+
+            try:
+                doc = DocumentoPDF(entrada)
+                total_paginas = len(doc)
+            except Exception as e:
+                log(f"❌ Erro leitura PDF {nome_de(entrada)}: {e}")
                 continue
+            totais[entrada] = total_paginas
 
-            writer = PdfWriter()
-            writer.add_page(reader.pages[i])
-            with open(destino, "wb") as f:
-                
-                writer.write(f)
-
-def localizar_pdf(pasta, chave):
-    nome_alvo = f"{chave}-procCTe.pdf"
-    for root, _, files in os.walk(pasta):
-        if nome_alvo in files:
-            return os.path.join(root, nome_alvo)
-    return None
+            with doc:
+                for i in range(total_paginas):
+                    if stop_event and stop_event.is_set():
+                        if status_callback: status_callback("Interrompendo leitura...")
+                        return
 
-def criar_overlay(texto_linhas, caminho_saida):
-    c = canvas.Canvas(caminho_saida, pagesize=A4)
-    width, height = A4
-    c.setFont("Helvetica-Bold", 10) 
-    x = 410
-    y = 120
-    c.setFillColorRGB(0, 0, 0)
-    linhas = texto_linhas.split('\n')
-    for linha in linhas:
-        c.drawString(x, y, linha)
-        y -= 12
-    c.save()
-
-def sobrepor_pdf(pdf_original, pdf_overlay, pdf_saida):
-    """Cola a etiqueta em cima do PDF original"""
-    reader_orig = PdfReader(pdf_original)
-    reader_over = PdfReader(pdf_overlay)
-    
-    page_orig = reader_orig.pages[0]
-    page_over = reader_over.pages[0]
-    
-    page_orig.merge_page(page_over)
-    
-    writer = PdfWriter()
-    writer.add_page(page_orig)
-    
-    with open(pdf_saida, "wb") as f:
-        writer.write(f)
-        
-    try: os.remove(pdf_overlay)
-    except: pass
\ No newline at end of file
+                    if status_callback:
+                        status_callback(f"Lendo página {i + 1} de {total_paginas}.")
+
+                    yield entrada, i, _ler_chave_pagina(doc, i, recorte, usar_texto, contadores, log)
+        return
+
+    # Confere o pyzbar uma vez aqui, para o aviso sair no log de quem chamou
+    _pyzbar(log)
+
+    tarefas = list(_tarefas_escaneamento(entradas, paginas_por_tarefa, limite_arquivo_pequeno))
+    executor = ProcessPoolExecutor(max_workers=processos)
+    try:
+        futuros = [
+            executor.submit(_escanear_intervalo, entrada, inicio, fim, recorte, usar_texto)
+            for entrada, inicio, fim in tarefas
+        ]
+        ultimo = None
+        for (entrada, inicio, _), futuro in zip(tarefas, futuros):
+            while True:
+                if stop_event and stop_event.is_set():
+                    if status_callback: status_callback("Interrompendo leitura...")
+                    return
+                try:
+                    total, resultados, parciais, erro = futuro.result(timeout=0.5)
+                    break
+                except FuturesTimeout:
+                    continue
+
+            _somar_contadores(contadores, parciais)
+
+            if erro:
+                if inicio == 0:
+                    log(f"❌ Erro leitura PDF {nome_de(entrada)}: {erro}")
+                continue
+            totais[entrada] = total
+
+            if status_callback and entrada is not ultimo:
+                status_callback(f"Abrindo PDF: {nome_de(entrada)}...")
+            ultimo = entrada
+
+            for i, chave in resultados:
+                if stop_event and stop_event.is_set():
+                    return
+                if status_callback:
+                    status_callback(f"Lendo página {i + 1} de {total}.")
+                yield entrada, i, chave
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def mapear_paginas_por_cte(entradas, mapa_chaves, log, status_callback=None, stop_event=None,
+                           recorte=None, usar_texto=True, contadores=None, processos: int = 1,
+                           localizador=None, cache=None):
+    """
+    Lê as páginas dos PDFs e retorna {chave: (entrada, índice da página)}
+    para as chaves de mapa_chaves, sem gravar nada em disco.
+    Com usar_texto, a chave é procurada primeiro na camada de texto e só
+    as páginas sem chave válida são renderizadas para leitura do código
+    de barras. contadores (dict) acumula quantas páginas cada caminho resolveu.
+    A primeira página encontrada para cada chave prevalece; se um
+    LocalizadorPDF for informado, as páginas também são registradas nele.
+    """
+    paginas = {}
+    for entrada, i, chave in escanear_paginas(
+        entradas, log, status_callback, stop_event,
+        recorte, usar_texto, contadores, processos, cache=cache
+    ):
+        if chave and chave in mapa_chaves and chave not in paginas:
+            paginas[chave] = (entrada, i)
+            if localizador is not None:
+                localizador.registrar(chave, entrada, i)
+    return paginas
+
+
+def paginas_em_fluxo(entradas, mapa_chaves, log=print, stop_event=None, recorte=None,
+                     usar_texto=True, contadores=None, processos: int = 1,
+                     abrir_cache=None, tamanho_fila: int = 256, espera: float = 0.5):
+    """
+    Versão em fluxo do mapear_paginas_por_cte: a leitura das páginas roda
+    numa thread e gera (chave, entrada, índice) assim que cada chave de
+    mapa_chaves é encontrada pela primeira vez. A fila entre a leitura e
+    quem consome é limitada: com ela cheia, a leitura espera.
+    Sem novidade em espera segundos, gera None (o consumidor pode cuidar
+    de outra coisa e voltar). abrir_cache cria o CacheBarcode já dentro
+    da thread, porque a conexão sqlite não pode trocar de thread.
+    """
+    fila = queue.Queue(maxsize=tamanho_fila)
+    parar = threading.Event()
+    fim = object()
+
+    def colocar(item):
+        while not parar.is_set():
+            try:
+                fila.put(item, timeout=espera)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def ler():
+        cache = None
+        try:
+            if abrir_cache:
+                try:
+                    cache = abrir_cache()
+                except Exception as e:
+                    log(f"⚠️  Cache de leitura de PDF indisponível: {e}")
+            encontradas = set()
+            for entrada, i, chave in escanear_paginas(
+                entradas, log, None, parar, recorte, usar_texto,
+                contadores, processos, cache=cache
+            ):
+                if chave and chave in mapa_chaves and chave not in encontradas:
+                    encontradas.add(chave)
+                    if not colocar((chave, entrada, i)):
+                        return
+        except Exception as e:
+            log(f"⚠️  Erro na leitura dos PDFs: {e}")
+        finally:
+            if cache:
+                cache.fechar()
+            colocar(fim)
+
+    leitura = threading.Thread(target=ler, name="leitura-pdf", daemon=True)
+    leitura.start()
+    try:
+        while True:
+            if stop_event and stop_event.is_set():
+                return
+            try:
+                item = fila.get(timeout=espera)
+            except queue.Empty:
+                yield None
+                continue
+            if item is fim:
+                return
+            yield item
+    finally:
+        parar.set()
+        leitura.join()
+
+
+class LocalizadorPDF:
+    """
+    Índice chave → (entrada, página) montado uma única vez, consultado em
+    tempo constante. É alimentado pelos nomes dos arquivos (PDFs já divididos,
+    com a chave no nome em qualquer caixa ou sufixo) e pela leitura das páginas.
+    Uma chave lida na página tem prioridade sobre a deduzida do nome.
+    """
+
+    def __init__(self):
+        self._lidas = {}
+        self._por_nome = {}
+
+    def __contains__(self, chave):
+        return chave in self._lidas or chave in self._por_nome
+
+    def __len__(self):
+        return len(self._lidas.keys() | self._por_nome.keys())
+
+    def indexar_nomes(self, entradas, chaves=None) -> list:
+        """
+        Indexa os PDFs de uma página com chave válida no nome e retorna as
+        entradas que ainda precisam ter as páginas lidas.
+        """
+        pendentes = []
+        for entrada in entradas:
+            nome = entrada.nome if isinstance(entrada, Entrada) else os.path.basename(entrada)
+            chave = chave_no_nome(nome)
+
+            if chave and chave_cte(chave) and (chaves is None or chave in chaves):
+                try:
+                    with DocumentoPDF(entrada) as doc:
+                        uma_pagina = len(doc) == 1
+                except Exception:
+                    uma_pagina = False
+
+                if uma_pagina:
+                    self._por_nome.setdefault(chave, (entrada, 0))
+                    continue
+
+            pendentes.append(entrada)
+        return pendentes
+
+    def registrar(self, chave, entrada, pagina):
+        """
+        Registra a página onde a chave foi lida (a primeira prevalece).
+        """
+        self._lidas.setdefault(chave, (entrada, pagina))
+
+    def localizar(self, chave):
+        return self._lidas.get(chave) or self._por_nome.get(chave)
+
+
+# Tamanho A4 em pontos (o mesmo de reportlab.lib.pagesizes.A4)
+A4_PONTOS = (595.2755905511812, 841.8897637795277)
+
+
+class ModeloEtiqueta:
+    """
+    Etiqueta do rateio montada uma única vez por execução: a fonte e a
+    posição ficam prontas em memória e, para cada CT-e, só o texto do
+    content stream muda.
+    """
+
+    FONTE = "/FRateio"
+
+    def __init__(self, x=410, y=120, fonte="Helvetica-Bold", tamanho=10, entrelinha=12):
+        self.x = x
+        self.y = y
+        self.tamanho = tamanho
+        self.entrelinha = entrelinha
+        self.recursos = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({
+                NameObject(self.FONTE): DictionaryObject({
+                    NameObject("/Type"): NameObject("/Font"),
+                    NameObject("/Subtype"): NameObject("/Type1"),
+                    NameObject("/BaseFont"): NameObject("/" + fonte),
+                    NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+                })
+            })
+        })
+        self._cabecalho = f"q 0 0 0 rg BT {self.FONTE} {tamanho} Tf {x} {y} Td ".encode()
+
+    @staticmethod
+    def _literal(linha):
+        texto = linha.encode("cp1252", "replace")
+        texto = texto.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+        return b"(" + texto + b") Tj"
+
+    def conteudo(self, texto_linhas):
+        """Operadores PDF que escrevem as linhas da etiqueta"""
+        linhas = texto_linhas.split("\n")
+        passo = f" 0 {-self.entrelinha} Td ".encode()
+        return self._cabecalho + passo.join(self._literal(l) for l in linhas) + b" ET Q"
+
+    def pagina(self, texto_linhas, largura=None, altura=None):
+        """Página só com a etiqueta, pronta para merge_page"""
+        if largura is None:
+            largura, altura = A4_PONTOS
+        stream = DecodedStreamObject()
+        stream.set_data(self.conteudo(texto_linhas))
+
+        page = PageObject.create_blank_page(width=largura, height=altura)
+        page[NameObject("/Resources")] = self.recursos
+        page[NameObject("/Contents")] = stream
+        return page
+
+    def carimbar(self, origem, texto_linhas, pagina=0):
+        """Devolve (página PyPDF2 carimbada, bytes do PDF de uma página)"""
+        page_orig = _leitor_pdf(origem).pages[pagina]
+        page_orig.merge_page(self.pagina(texto_linhas))
+
+        writer = PdfWriter()
+        writer.add_page(page_orig)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        return page_orig, buffer.getvalue()
+
+    def fechar(self):
+        pass
+
+
+class EtiquetaPyMuPDF(ModeloEtiqueta):
+    """
+    Motor de carimbo pelo PyMuPDF: copia a página com insert_pdf e anexa o
+    content stream da etiqueta direto nela, sem overlay nem merge do PyPDF2.
+    Mesmo layout e mesmas coordenadas PDF do ModeloEtiqueta.
+    """
+
+    def __init__(self, x=410, y=120, fonte="Helvetica-Bold", tamanho=10, entrelinha=12, max_abertos=None):
+        super().__init__(x, y, fonte, tamanho, entrelinha)
+        self._fonte_obj = f"<</Type/Font/Subtype/Type1/BaseFont/{fonte}/Encoding/WinAnsiEncoding>>"
+        self.max_abertos = max_abertos or MAX_LEITORES_ABERTOS
+        self._docs = OrderedDict()
+
+    def _documento(self, origem):
+        identificador = _identificador_origem(origem)
+        doc = self._docs.get(identificador)
+        if doc is not None:
+            self._docs.move_to_end(identificador)
+            return doc
+
+        doc = DocumentoPDF(origem)
+        self._docs[identificador] = doc
+        while len(self._docs) > self.max_abertos:
+            _, antigo = self._docs.popitem(last=False)
+            antigo.fechar()
+        return doc
+
+    @staticmethod
+    def _dicionario_indireto(doc, xref, chave):
+        """xref do dicionário em /chave, convertendo-o em objeto indireto se preciso"""
+        tipo, valor = doc.xref_get_key(xref, chave)
+        if tipo == "xref":
+            return int(valor.split()[0])
+        novo = doc.get_new_xref()
+        doc.update_object(novo, valor if tipo == "dict" else "<<>>")
+        doc.xref_set_key(xref, chave, f"{novo} 0 R")
+        return novo
+
+    def _novo_stream(self, doc, dados):
+        xref = doc.get_new_xref()
+        doc.update_object(xref, "<<>>")
+        doc.update_stream(xref, dados)
+        return xref
+
+    def carimbar(self, origem, texto_linhas, pagina=0):
+        """Devolve (None, bytes do PDF de uma página); a página PyPDF2 não é montada"""
+        # insert_text recalcula as larguras da fonte a cada documento novo;
+        # montar o stream à mão mantém o custo por CT-e no insert_pdf + tobytes
+        saida = fitz.open()
+        try:
+            saida.insert_pdf(self._documento(origem).doc, from_page=pagina, to_page=pagina)
+            xref_pagina = saida[0].xref
+
+            fonte = saida.get_new_xref()
+            saida.update_object(fonte, self._fonte_obj)
+            recursos = self._dicionario_indireto(saida, xref_pagina, "Resources")
+            fontes = self._dicionario_indireto(saida, recursos, "Font")
+            saida.xref_set_key(fontes, self.FONTE[1:], f"{fonte} 0 R")
+
+            # O conteúdo original fica entre q/Q para não alterar a posição da etiqueta
+            abre = self._novo_stream(saida, b"q")
+            etiqueta = self._novo_stream(saida, b"Q " + self.conteudo(texto_linhas))
+            tipo, valor = saida.xref_get_key(xref_pagina, "Contents")
+            if tipo == "array":
+                originais = valor.strip()[1:-1]
+            elif tipo == "xref":
+                originais = valor
+            else:
+                originais = ""
+            saida.xref_set_key(xref_pagina, "Contents", f"[{abre} 0 R {originais} {etiqueta} 0 R]")
+
+            return None, saida.tobytes(garbage=1)
+        finally:
+            saida.close()
+
+    def fechar(self):
+        for doc in self._docs.values():
+            doc.fechar()
+        self._docs.clear()
+
+
+MOTORES_CARIMBO = {
+    "pypdf": ModeloEtiqueta,
+    "pymupdf": EtiquetaPyMuPDF,
+}
+
+
+def criar_motor_carimbo(nome="pypdf"):
+    """Instancia o motor de carimbo configurado (opção motor_carimbo)"""
+    try:
+        return MOTORES_CARIMBO[nome]()
+    except KeyError:
+        raise ValueError(
+            f"Motor de carimbo desconhecido: {nome!r} (opções: {', '.join(MOTORES_CARIMBO)})"
+        ) from None
+
+
+# Leitores PyPDF2 das entradas, reaproveitados entre CT-es da mesma origem
+_leitores = OrderedDict()
+MAX_LEITORES_ABERTOS = 16
+
+
+def _identificador_origem(origem):
+    """Chave de cache de um caminho ou Entrada (muda se o arquivo mudar)"""
+    if isinstance(origem, Entrada):
+        return (origem.id, origem.tamanho, origem.mtime)
+    st = os.stat(origem)
+    return (os.path.abspath(origem), st.st_size, st.st_mtime_ns)
+
+
+def _leitor_pdf(origem) -> PdfReader:
+    """
+    PdfReader de um caminho ou Entrada, mantido em cache (LRU) para que
+    várias páginas do mesmo lote não reabram o arquivo.
+    """
+    identificador = _identificador_origem(origem)
+    reader = _leitores.get(identificador)
+    if reader is not None:
+        _leitores.move_to_end(identificador)
+        return reader
+
+    if isinstance(origem, Entrada) and origem.membro:
+        reader = PdfReader(io.BytesIO(ler_bytes(origem)))
+    else:
+        reader = PdfReader(origem.caminho if isinstance(origem, Entrada) else origem)
+
+    _leitores[identificador] = reader
+    while len(_leitores) > MAX_LEITORES_ABERTOS:
+        _leitores.popitem(last=False)
+    return reader
+
+
+def fechar_leitores():
+    _leitores.clear()
+
+
+def _carimbar_em_memoria(pdf_original, texto_linhas, pagina=0, modelo=None):
+    modelo = modelo or ModeloEtiqueta()
+    return modelo.carimbar(pdf_original, texto_linhas, pagina)
+
+
+# Motores de carimbo de cada processo do pool, por nome
+_motores_processo = {}
+
+
+def _carimbar_processo(origem, pagina, texto_linhas, pdf_saida, devolver_bytes, motor="pypdf"):
+    """
+    Executado no pool: carimba e grava um CT-e, devolvendo
+    (tamanho, bytes ou None, erro). Os leitores ficam no cache do processo.
+    """
+    modelo = _motores_processo.get(motor)
+    if modelo is None:
+        modelo = _motores_processo[motor] = criar_motor_carimbo(motor)
+    try:
+        _, dados = _carimbar_em_memoria(origem, texto_linhas, pagina, modelo)
+        with open(pdf_saida, "wb") as f:
+            f.write(dados)
+        return len(dados), (dados if devolver_bytes else None), None
+    except Exception as e:
+        return 0, None, f"{type(e).__name__}: {e}"
+
+
+def _pagina_de_bytes(dados):
+    return PdfReader(io.BytesIO(dados)).pages[0]
+
+
+def ler_pagina(caminho, indice=0):
+    """Página de um PDF já gravado, lido para a memória (o arquivo não fica aberto)"""
+    with open(caminho, "rb") as f:
+        return PdfReader(io.BytesIO(f.read())).pages[indice]
+
+
+def carimbar_lote(tarefas, processos=1, stop_event=None, modelo=None,
+                  devolver_paginas=False, minimo_paralelo=50, motor="pypdf"):
+    """
+    Carimba uma lista de tarefas (origem, pagina, texto_linhas, pdf_saida),
+    gerando (pagina_carimbada ou None, tamanho, erro) na mesma ordem.
+    Com processos != 1 e lotes grandes, o trabalho vai para um pool
+    (0 = todos os núcleos) e a página volta em bytes só se devolver_paginas.
+    motor é o nome do motor de carimbo usado nos processos do pool.
+    """
+    tarefas = list(tarefas)
+    processos = processos_pool(processos)
+
+    if processos == 1 or len(tarefas) < minimo_paralelo:
+        modelo = modelo or criar_motor_carimbo(motor)
+        for origem, pagina, texto_linhas, pdf_saida in tarefas:
+            if stop_event and stop_event.is_set():
+                return
+            try:
+                page, dados = _carimbar_em_memoria(origem, texto_linhas, pagina, modelo)
+                with open(pdf_saida, "wb") as f:
+                    f.write(dados)
+                if devolver_paginas and page is None:
+                    page = _pagina_de_bytes(dados)
+                yield (page if devolver_paginas else None), len(dados), None
+            except Exception as e:
+                yield None, 0, f"{type(e).__name__}: {e}"
+        return
+
+    # Janela limitada de tarefas em andamento: mantém a ordem de saída e
+    # não acumula bytes de páginas prontas além do necessário
+    janela = processos * 4
+    executor = ProcessPoolExecutor(max_workers=processos)
+    try:
+        pendentes = deque()
+        proximas = iter(tarefas)
+        while True:
+            while len(pendentes) < janela:
+                tarefa = next(proximas, None)
+                if tarefa is None:
+                    break
+                pendentes.append(executor.submit(_carimbar_processo, *tarefa, devolver_paginas, motor))
+            if not pendentes:
+                return
+
+            futuro = pendentes.popleft()
+            while True:
+                if stop_event and stop_event.is_set():
+                    return
+                try:
+                    tamanho, dados, erro = futuro.result(timeout=0.5)
+                    break
+                except FuturesTimeout:
+                    continue
+
+            page = _pagina_de_bytes(dados) if dados else None
+            yield page, tamanho, erro
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def carimbar_fluxo(tarefas, processos=1, stop_event=None, modelo=None,
+                   quantidade=None, minimo_paralelo=50, motor="pypdf", devolver_paginas=False):
+    """
+    Como o carimbar_lote, mas para tarefas que chegam aos poucos: tarefas é
+    um iterável de (identificador, (origem, pagina, texto_linhas, pdf_saida))
+    que também pode gerar None quando ainda não há tarefa nova. Gera
+    (identificador, pagina_carimbada ou None, tamanho, erro) na ordem de
+    chegada das tarefas, com a página só se devolver_paginas, e repassa
+    o None quando não há nada pronto.
+    quantidade é a estimativa de tarefas, usada para decidir pelo pool.
+    """
+    processos = processos_pool(processos)
+
+    if processos == 1 or (quantidade is not None and quantidade < minimo_paralelo):
+        modelo = modelo or criar_motor_carimbo(motor)
+        for recebida in tarefas:
+            if stop_event and stop_event.is_set():
+                return
+            if recebida is None:
+                yield None
+                continue
+            identificador, (origem, pagina, texto_linhas, pdf_saida) = recebida
+            try:
+                page, dados = _carimbar_em_memoria(origem, texto_linhas, pagina, modelo)
+                with open(pdf_saida, "wb") as f:
+                    f.write(dados)
+                if devolver_paginas and page is None:
+                    page = _pagina_de_bytes(dados)
+                yield identificador, (page if devolver_paginas else None), len(dados), None
+            except Exception as e:
+                yield identificador, None, 0, f"{type(e).__name__}: {e}"
+        return
+
+    janela = processos * 4
+    executor = ProcessPoolExecutor(max_workers=processos)
+    try:
+        pendentes = deque()
+        for recebida in tarefas:
+            if stop_event and stop_event.is_set():
+                return
+            if recebida is not None:
+                identificador, tarefa = recebida
+                pendentes.append((identificador, executor.submit(_carimbar_processo, *tarefa, devolver_paginas, motor)))
+
+            # Entrega o que já terminou; com a janela cheia, espera o mais antigo
+            entregou = False
+            while pendentes and (pendentes[0][1].done() or len(pendentes) >= janela):
+                if stop_event and stop_event.is_set():
+                    return
+                identificador, futuro = pendentes[0]
+                try:
+                    tamanho, dados, erro = futuro.result(timeout=0.5)
+                except FuturesTimeout:
+                    continue
+                pendentes.popleft()
+                entregou = True
+                yield identificador, (_pagina_de_bytes(dados) if dados else None), tamanho, erro
+            if recebida is None and not entregou:
+                yield None
+
+        while pendentes:
+            identificador, futuro = pendentes[0]
+            if stop_event and stop_event.is_set():
+                return
+            try:
+                tamanho, dados, erro = futuro.result(timeout=0.5)
+            except FuturesTimeout:
+                continue
+            pendentes.popleft()
+            yield identificador, (_pagina_de_bytes(dados) if dados else None), tamanho, erro
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+class SaidaUnificada:
+    """
+    PDF unificado gravado em volumes: as páginas carimbadas entram direto no
+    writer do volume atual e, ao atingir o limite de páginas ou de bytes, o
+    volume vai para o disco e é liberado da memória. Se couber tudo em um
+    volume só, o arquivo sai sem o sufixo _parteNN.
+    """
+
+    def __init__(self, pasta, nome_base, max_paginas=0, max_bytes=0):
+        self.pasta = pasta
+        self.nome_base = nome_base
+        self.max_paginas = max_paginas or 0
+        self.max_bytes = max_bytes or 0
+        self.arquivos = []
+        self.paginas = 0
+        self._writer = None
+        self._paginas_volume = 0
+        self._bytes_volume = 0
+        self._cheio = False
+        # Leitores de origem das páginas do volume: o PdfWriter reconhece um
+        # leitor já copiado pelo id(); se um leitor temporário fosse coletado,
+        # outro poderia herdar o id e receber os objetos de uma página anterior
+        self._leitores_volume = {}
+
+    def adicionar(self, pagina, tamanho=0):
+        """Acrescenta a página; tamanho é o estimado em bytes (ex.: o do PDF individual)"""
+        if self._cheio:
+            self._gravar_volume()
+        if self._writer is None:
+            self._writer = PdfWriter()
+            self._paginas_volume = 0
+            self._bytes_volume = 0
+
+        self._writer.add_page(pagina)
+        if pagina.indirect_reference is not None:
+            leitor = pagina.indirect_reference.pdf
+            self._leitores_volume[id(leitor)] = leitor
+        self.paginas += 1
+        self._paginas_volume += 1
+        self._bytes_volume += tamanho
+
+        # O volume só é gravado quando chega a próxima página, assim dá
+        # para saber se haverá mais de um volume antes de escolher o nome
+        self._cheio = bool(
+            (self.max_paginas and self._paginas_volume >= self.max_paginas)
+            or (self.max_bytes and self._bytes_volume >= self.max_bytes)
+        )
+
+    def _gravar_volume(self, ultimo=False):
+        if self._writer is None:
+            return
+        if ultimo and not self.arquivos:
+            nome = f"{self.nome_base}.pdf"
+        else:
+            nome = f"{self.nome_base}_parte{len(self.arquivos) + 1:02d}.pdf"
+        with open(os.path.join(self.pasta, nome), "wb") as f:
+            self._writer.write(f)
+        self.arquivos.append(nome)
+        self._writer = None
+        self._leitores_volume = {}
+        self._cheio = False
+
+    def fechar(self, gravar=True):
+        """Grava o volume pendente (ou o descarta, se gravar=False) e devolve os nomes gerados"""
+        if gravar:
+            self._gravar_volume(ultimo=True)
+        self._writer = None
+        self._leitores_volume = {}
+        return list(self.arquivos)
@@ -0,0 +1,308 @@
+import hashlib
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+
+
+COLUNA_CTE = "N° CT-e"
+COLUNA_VALOR = "Vlr Contabil"
+COLUNA_OPERACAO = "Operação"
+
+# Mesma ordem de prioridade de identificar_prefixo_oper
+PREFIXOS_OPERACAO = (("VENDA", "V"), ("BONIF", "B"), ("AMOSTRA", "A"))
+
+COLUNAS_RATEIO = (COLUNA_CTE, COLUNA_VALOR, COLUNA_OPERACAO)
+COLUNAS_OBRIGATORIAS = (COLUNA_CTE, COLUNA_VALOR)
+
+# Planilhas já lidas guardadas em parquet (só com pyarrow instalado)
+MAX_PLANILHAS_CACHE = 8
+
+
+# =====================================================
+# LEITURA
+# =====================================================
+
+def _instalado(modulo):
+    return importlib.util.find_spec(modulo) is not None
+
+
+def motor_excel(preferido="auto"):
+    """Engine do read_excel: "auto" usa o calamine quando instalado (None = padrão do pandas)"""
+    if preferido and preferido != "auto":
+        return preferido
+    return "calamine" if _instalado("python_calamine") else None
+
+
+def eh_csv(caminho):
+    return str(caminho).lower().endswith((".csv", ".txt"))
+
+
+def _ler_excel(caminho, motor, sep=";", encoding="utf-8-sig"):
+    # Só as colunas do rateio, tudo como texto: a conversão fica com preparar_planilha
+    kwargs = dict(usecols=lambda coluna: coluna in COLUNAS_RATEIO, dtype=str)
+    if eh_csv(caminho):
+        return pd.read_csv(caminho, sep=sep, encoding=encoding, **kwargs)
+    if motor:
+        try:
+            return pd.read_excel(caminho, engine=motor, **kwargs)
+        except (ImportError, ValueError):
+            pass
+    return pd.read_excel(caminho, **kwargs)
+
+
+def _arquivo_cache(caminho, pasta_cache, motor, sep, encoding):
+    # Parâmetros de leitura entram na chave: outro sep/encoding/engine é outra leitura
+    st = os.stat(caminho)
+    identificador = f"{os.path.abspath(caminho)}|{st.st_size}|{st.st_mtime_ns}|{motor}|{sep}|{encoding}"
+    nome = hashlib.blake2b(identificador.encode("utf-8"), digest_size=16).hexdigest()
+    return os.path.join(pasta_cache, f"{nome}.parquet")
+
+
+def _podar_cache(pasta_cache, maximo=MAX_PLANILHAS_CACHE):
+    arquivos = sorted(
+        (e for e in os.scandir(pasta_cache) if e.name.endswith(".parquet")),
+        key=lambda e: e.stat().st_mtime,
+        reverse=True,
+    )
+    for entrada in arquivos[maximo:]:
+        try:
+            os.remove(entrada.path)
+        except OSError:
+            pass
+
+
+def carregar_planilha(caminho, motor="auto", pasta_cache=None, sep=";", encoding="utf-8-sig"):
+    """
+    Lê só as colunas usadas no rateio (como texto), com o calamine quando
+    disponível; .csv/.txt vão pelo read_csv com sep e encoding.
+    Com pasta_cache e pyarrow instalado, o resultado fica em parquet,
+    identificado por caminho, tamanho e mtime da planilha e pelos
+    parâmetros de leitura; uma leitura sem as colunas obrigatórias
+    (ex.: sep errado) não vai para o cache.
+    """
+    motor = motor_excel(motor)
+    if not pasta_cache or not _instalado("pyarrow"):
+        return _ler_excel(caminho, motor, sep, encoding)
+
+    if eh_csv(caminho):
+        arquivo_cache = _arquivo_cache(caminho, pasta_cache, None, sep, encoding)
+    else:
+        arquivo_cache = _arquivo_cache(caminho, pasta_cache, motor, None, None)
+    if os.path.exists(arquivo_cache):
+        try:
+            df = pd.read_parquet(arquivo_cache)
+            os.utime(arquivo_cache)
+            return df
+        except Exception:
+            pass
+
+    df = _ler_excel(caminho, motor, sep, encoding)
+    if not all(coluna in df.columns for coluna in COLUNAS_OBRIGATORIAS):
+        return df
+    try:
+        os.makedirs(pasta_cache, exist_ok=True)
+        temporario = arquivo_cache + ".tmp"
+        df.to_parquet(temporario, index=False)
+        os.replace(temporario, arquivo_cache)
+        _podar_cache(pasta_cache)
+    except Exception:
+        pass
+    return df
+
+
+# =====================================================
+# PREPARAÇÃO VETORIZADA
+# =====================================================
+
+def _coluna(df, nome):
+    if nome in df.columns:
+        return df[nome]
+    return pd.Series([None] * len(df), index=df.index, dtype=object)
+
+
+def valores_em_centavos(coluna):
+    """
+    Versão vetorizada de converter_moeda_para_decimal + quantize(0.01, ROUND_HALF_UP).
+    Devolve (centavos, positivo): centavos em int64 (0 quando inválido) e
+    a máscara dos valores > 0 antes do arredondamento, como no loop original.
+    """
+    s = coluna.astype(str).str.strip()
+    vazio = s.isin(["", "nan", "None", "-", "—"]).to_numpy()
+
+    s = s.str.replace(r"[^\d\.,-]", "", regex=True)
+    ambos = (s.str.contains(",", regex=False) & s.str.contains(".", regex=False)).to_numpy()
+    if ambos.any():
+        s[ambos] = s[ambos].str.replace(".", "", regex=False)
+    s = s.str.replace(",", ".", regex=False)
+
+    # Só dígitos, ponto e sinal sobram: to_numeric valida o formato como o Decimal
+    numero = pd.to_numeric(s, errors="coerce").to_numpy()
+    valido = ~vazio & ~np.isnan(numero)
+
+    partes = s.str.split(".", n=1, expand=True)
+    inteiro = partes[0]
+    fracao = (partes[1].fillna("") if partes.shape[1] > 1 else pd.Series("", index=s.index))
+    fracao3 = fracao.str[:3].str.ljust(3, "0")
+
+    unidades = pd.to_numeric(inteiro.str.lstrip("-"), errors="coerce").fillna(0).to_numpy(np.int64)
+    decimos = pd.to_numeric(fracao3.str[:2], errors="coerce").fillna(0).to_numpy(np.int64)
+    arredonda = (fracao3.str[2] >= "5").to_numpy(np.int64)
+
+    centavos = unidades * 100 + decimos + arredonda
+    centavos = np.where(inteiro.str.startswith("-").to_numpy(), -centavos, centavos)
+
+    positivo = valido & (np.nan_to_num(numero) > 0)
+    return np.where(valido, centavos, 0), positivo
+
+
+def prefixos_operacao(coluna):
+    """Versão vetorizada de identificar_prefixo_oper ("" quando não classifica)"""
+    op = coluna.fillna("").astype(str).str.upper()
+    condicoes = [op.str.contains(termo, regex=False).to_numpy() for termo, _ in PREFIXOS_OPERACAO]
+    return np.select(condicoes, [p for _, p in PREFIXOS_OPERACAO], default="")
+
+
+def preparar_planilha(df, ordenar=True):
+    """
+    Normaliza de uma vez as colunas usadas no rateio: número do CT-e
+    (inteiro), valor em centavos e prefixo V/B/A da operação.
+    Linhas sem número de CT-e numérico ficam de fora.
+    Devolve (preparada, descartadas), com a preparada na ordem dos grupos
+    (ordenar=False mantém a ordem do arquivo).
+    Sem as colunas de COLUNAS_OBRIGATORIAS, gera ValueError.
+    """
+    ausentes = [coluna for coluna in COLUNAS_OBRIGATORIAS if coluna not in df.columns]
+    if ausentes:
+        raise ValueError(f"Coluna(s) obrigatória(s) ausente(s) na planilha: {', '.join(ausentes)}")
+
+    ncte = pd.to_numeric(_coluna(df, COLUNA_CTE), errors="coerce")
+    inteiro = ncte.notna() & (ncte == ncte.round())
+
+    centavos, positivo = valores_em_centavos(_coluna(df, COLUNA_VALOR))
+    prefixo = prefixos_operacao(_coluna(df, COLUNA_OPERACAO))
+
+    preparada = pd.DataFrame({
+        "ncte": ncte.where(inteiro),
+        "centavos": centavos,
+        "prefixo": prefixo,
+        "valida": positivo & (prefixo != ""),
+    }, index=df.index)
+
+    # CT-e vazio é ignorado pelo groupby, como antes; só conta o que não é número
+    descartadas = int((_coluna(df, COLUNA_CTE).notna() & ~inteiro).sum())
+    preparada = preparada[inteiro].astype({"ncte": np.int64})
+    if ordenar:
+        # mergesort é estável: mantém a ordem das linhas dentro de cada CT-e
+        preparada = preparada.sort_values("ncte", kind="mergesort")
+    return preparada, descartadas
+
+
+def agrupar_por_cte(preparada):
+    """
+    Percorre a planilha preparada gerando (ncte_str, linhas), onde linhas
+    é a lista de (prefixo, centavos) válidos do CT-e, em ordem crescente de CT-e.
+    """
+    ncte = preparada["ncte"].to_numpy()
+    centavos = preparada["centavos"].to_numpy()
+    prefixo = preparada["prefixo"].to_numpy()
+    valida = preparada["valida"].to_numpy()
+
+    if not len(ncte):
+        return
+
+    inicios = np.flatnonzero(np.r_[True, ncte[1:] != ncte[:-1]])
+    fins = np.r_[inicios[1:], len(ncte)]
+
+    for inicio, fim in zip(inicios, fins):
+        linhas = [
+            (str(prefixo[i]), int(centavos[i]))
+            for i in range(inicio, fim) if valida[i]
+        ]
+        yield str(ncte[inicio]), linhas
+
+
+# =====================================================
+# LEITURA EM BLOCOS (ARQUIVOS GRANDES)
+# =====================================================
+
+def _blocos_xlsx(caminho, tamanho_bloco):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        linhas = wb.active.iter_rows(values_only=True)
+        cabecalho = next(linhas, None) or ()
+        indices = {nome: i for i, nome in enumerate(cabecalho) if nome in COLUNAS_RATEIO}
+        colunas = list(indices)
+
+        bloco = []
+        for linha in linhas:
+            # Texto como no read_excel(dtype=str); célula vazia continua None
+            bloco.append([
+                None if i >= len(linha) or linha[i] is None else str(linha[i])
+                for i in indices.values()
+            ])
+            if len(bloco) >= tamanho_bloco:
+                yield pd.DataFrame(bloco, columns=colunas, dtype=object)
+                bloco = []
+        if bloco:
+            yield pd.DataFrame(bloco, columns=colunas, dtype=object)
+    finally:
+        wb.close()
+
+
+def ler_planilha_em_blocos(caminho, tamanho_bloco=50_000, sep=";", encoding="utf-8-sig"):
+    """
+    Lê a planilha (CSV ou XLSX em modo read-only) em blocos de linhas,
+    só com as colunas do rateio, sem carregar o arquivo inteiro.
+    """
+    if eh_csv(caminho):
+        yield from pd.read_csv(
+            caminho, sep=sep, encoding=encoding, dtype=str,
+            usecols=lambda coluna: coluna in COLUNAS_RATEIO,
+            chunksize=tamanho_bloco,
+        )
+    else:
+        yield from _blocos_xlsx(caminho, tamanho_bloco)
+
+
+def agrupar_em_fluxo(blocos, contadores=None):
+    """
+    Equivalente ao agrupar_por_cte para arquivos lidos em blocos: gera um
+    CT-e por vez, na ordem do arquivo, guardando só o grupo que atravessa
+    o fim do bloco. A planilha precisa vir agrupada (ou ordenada) por CT-e;
+    um CT-e que reaparece depois de outro gera ValueError.
+    """
+    vistos = set()
+    pendente = None
+
+    def grupos_de(preparada):
+        for ncte_str, linhas in agrupar_por_cte(preparada):
+            if ncte_str in vistos:
+                raise ValueError(
+                    f"CT-e {ncte_str} aparece em trechos separados da planilha; "
+                    "para a leitura em blocos ela precisa estar ordenada por N° CT-e."
+                )
+            vistos.add(ncte_str)
+            yield ncte_str, linhas
+
+    for bloco in blocos:
+        preparada, descartadas = preparar_planilha(bloco, ordenar=False)
+        if contadores is not None:
+            contadores["descartadas"] = contadores.get("descartadas", 0) + descartadas
+        if pendente is not None:
+            preparada = pd.concat([pendente, preparada])
+        if preparada.empty:
+            pendente = None
+            continue
+
+        # O último CT-e do bloco pode continuar no próximo
+        ultimo = preparada["ncte"].to_numpy() == preparada["ncte"].iat[-1]
+        corte = 0 if ultimo.all() else len(ultimo) - int(np.argmin(ultimo[::-1]))
+        pendente = preparada.iloc[corte:]
+        yield from grupos_de(preparada.iloc[:corte])
+
+    if pendente is not None:
+        yield from grupos_de(pendente)
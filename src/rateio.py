@@ -1,34 +1,24 @@
 import os
 import shutil
+import sys
 import time
-from decimal import Decimal, ROUND_HALF_UP
-from pandas import read_excel, Grouper
-from PyPDF2 import PdfReader, PdfWriter
+from datetime import datetime
 import re
 import traceback 
-import pandas as pd
-
-from .pdf_utils import (
-    split_pdf_por_cte,
-    localizar_pdf,
-    criar_overlay,
-    sobrepor_pdf
-)
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+# pandas, PyMuPDF, PyPDF2 e numpy são importados dentro de processar, só nas
+# fases que os usam: importar este módulo (GUI, CLI) continua leve
 from .xml_utils import (
-    extrair_chave_cte,
-    extrair_valor_total_cte,
-    classificar_cte,
-    inf_cte,
-    chave_cte,
-    extrair_numero_cte_xml
+    extrair_dados_lote,
+    chave_cte
 )
 
-from .generalsutils import (
-    converter_moeda_para_decimal,
-    formato_brl,
-    identificar_prefixo_oper
-)
+from .arquivos import Inventario, fechar_zips
+from .cache import CacheXML, CacheBarcode
+from .diario import DiarioExecucao, assinatura_entradas
+from .config import CACHE_XML, CACHE_BARCODE, CACHE_PLANILHAS, OPCOES_PADRAO
 
 def processar(
     planilha: str,
@@ -40,225 +30,540 @@ def processar(
     logger_func,
     status_func,
     progresso=None,
-    stop_event = None
+    stop_event = None,
+    opcoes: dict | None = None,
+    retomar: bool = False,
+    inventario=None
 ):
-    tempo_inicial = time.time()
-
-    # Helpers
-    def log_info(msg): logger_func(f"ℹ️  {msg}")
-    def log_ok(msg):   logger_func(f"✅ {msg}", tag="sucesso")
-    def log_err(msg):  logger_func(f"❌ {msg}", tag="erro")
-    def log_warn(msg): logger_func(f"⚠️  {msg}", tag="aviso")
+    leitura_planilha = None
+    diario = None
+    try:
+        tempo_inicial = time.time()
+        opcoes = {**OPCOES_PADRAO, **(opcoes or {})}
+        em_blocos = opcoes["planilha_em_blocos"]
+        # Na leitura em blocos cada CT-e é concluído ao sair da planilha, o que
+        # exige as páginas já mapeadas: o pipeline não se aplica
+        pipeline = opcoes["pipeline"] and not em_blocos
+
+        # Helpers
+        def log_info(msg): logger_func(f"ℹ️  {msg}")
+        def log_ok(msg):   logger_func(f"✅ {msg}", tag="sucesso")
+        def log_err(msg):  logger_func(f"❌ {msg}", tag="erro")
+        def log_warn(msg): logger_func(f"⚠️  {msg}", tag="aviso")
+
+        if opcoes["pipeline"] and em_blocos:
+            log_info("Leitura da planilha em blocos: o pipeline fica desativado nesta execução.")
     
-    def atualizar_status(msg):
-        status_func(msg)
-
-    sucesso = 0
-    erros_chave = 0
-    erros_pdf = 0
-    cte_complemento_qtd = 0
-    lista_erros_chave = []
-    lista_erros_pdf = []
-    dados_excel = []
-
-    def gerar_relatorio(cte, status, valor_xml = 0, valor_planilha = 0, msg = '', arquivos = ''):
-        dados_excel.append({'CTE': str(cte),
-                            'Status': status,
-                            'Valor XML': float(valor_xml) if valor_xml else 0.0,
-                            'Valor Planilha': float(valor_planilha) if valor_planilha else 0.0,
-                            'Diferença': float(valor_xml-valor_planilha) if valor_xml and valor_planilha else 0.0,
-                            'Mensagem': msg,
-                            'Arquivo Gerado': arquivos})
-    atualizar_status("Iniciando varredura de XMLs")
+        def atualizar_status(msg):
+            status_func(msg)
+
+        sucesso = 0
+        erros_chave = 0
+        erros_pdf = 0
+        cte_complemento_qtd = 0
+        lista_erros_chave = []
+        lista_erros_pdf = []
+        dados_excel = []
+
+        caminho_excel = None
+        arquivos_unificados = []
+
+        def resumo(concluido=False):
+            """Resultado da execução (usado pela CLI e por quem chama processar)"""
+            return {
+                "concluido": concluido,
+                "interrompido": bool(stop_event and stop_event.is_set()),
+                "sucesso": sucesso,
+                "erros": erros_chave + erros_pdf,
+                "erros_xml": list(lista_erros_chave),
+                "erros_pdf": list(lista_erros_pdf),
+                "complementos": cte_complemento_qtd,
+                "relatorio": caminho_excel,
+                "pdf_unificado": [os.path.join(pasta_saida, n) for n in arquivos_unificados],
+                "tempo": round(time.time() - tempo_inicial, 2),
+            }
+
+        def gerar_relatorio(cte, status, valor_xml = 0, valor_planilha = 0, msg = '', arquivos = ''):
+            dados_excel.append({'CTE': str(cte),
+                                'Status': status,
+                                'Valor XML': float(valor_xml) if valor_xml else 0.0,
+                                'Valor Planilha': float(valor_planilha) if valor_planilha else 0.0,
+                                'Diferença': float(valor_xml-valor_planilha) if valor_xml and valor_planilha else 0.0,
+                                'Mensagem': msg,
+                                'Arquivo Gerado': arquivos})
+
+        def carregar_grupos():
+            """Lê a planilha inteira e devolve (grupos por CT-e, linhas descartadas)"""
+            from .planilha import carregar_planilha, preparar_planilha, agrupar_por_cte
+
+            df = carregar_planilha(
+                planilha,
+                motor=opcoes["motor_planilha"],
+                pasta_cache=CACHE_PLANILHAS if opcoes["cache_planilha"] else None,
+                sep=opcoes["csv_separador"],
+                encoding=opcoes["csv_encoding"],
+            )
+            preparada, descartadas = preparar_planilha(df)
+            del df
+            return list(agrupar_por_cte(preparada)), descartadas
+
+        # Em pipeline, a planilha é lida numa thread enquanto os XMLs são indexados
+        if pipeline:
+            leitura_planilha = ThreadPoolExecutor(max_workers=1, thread_name_prefix="planilha")
+            grupos_futuros = leitura_planilha.submit(carregar_grupos)
+
+        atualizar_status("Listando arquivos de entrada")
+        # A interface pode já ter listado as pastas (para conferir a retomada)
+        if inventario is None:
+            inventario = Inventario(
+                [pasta_xml, pasta_pdfs],
+                recursivo=opcoes.get("recursivo", False)
+            )
+
+        # Diário em pasta_saida: permite retomar uma execução cancelada ou interrompida
+        diario = DiarioExecucao(
+            pasta_saida,
+            assinatura_entradas(planilha, pasta_pdfs, pasta_xml, opcoes, inventario),
+            retomar=retomar
+        )
+        if diario.retomado:
+            log_info(f"Retomando a execução anterior: {len(diario.concluidos)} CT-e(s) já gravado(s).")
+        elif retomar:
+            log_info("Nenhuma execução interrompida com estas entradas; processando do início.")
+
+        atualizar_status("Iniciando varredura de XMLs")
     
-    mapa_cte = {}
+        mapa_cte = {}
+
+        if pasta_xml and os.path.exists(pasta_xml):
+            arquivos_xml = inventario.listar(pasta_xml, ".xml")
+            log_info(f"Encontrados {len(arquivos_xml)} arquivos XML.")
 
-    if pasta_xml and os.path.isdir(pasta_xml):
-        arquivos_xml = [f for f in os.listdir(pasta_xml) if f.lower().endswith(".xml")]
-        log_info(f"Encontrados {len(arquivos_xml)} arquivos XML.")
+            cache_xml = None
+            conhecidos = {}
+            novos = []
+            if opcoes.get("cache_xml"):
+                try:
+                    cache_xml = CacheXML(CACHE_XML)
+                    conhecidos = cache_xml.carregar(pasta_xml)
+                except Exception as e:
+                    log_warn(f"Cache de XML indisponível: {e}")
+                    cache_xml = None
+
+            def salvar_cache_xml(remover_ausentes):
+                if not cache_xml:
+                    return
+                try:
+                    cache_xml.gravar(pasta_xml, novos)
+                    if remover_ausentes:
+                        cache_xml.remover(conhecidos.keys())
+                except Exception as e:
+                    log_warn(f"Não foi possível atualizar o cache de XML: {e}")
+                finally:
+                    cache_xml.fechar()
+
+            # Separa o que já está no cache do que precisa ser lido
+            registros = {}
+            pendentes = []
+            for entrada in arquivos_xml:
+                anterior = conhecidos.pop(entrada.id, None)
+                if anterior and anterior[:2] == (entrada.tamanho, entrada.mtime):
+                    registros[entrada.id] = anterior[2]
+                else:
+                    pendentes.append(entrada)
+
+            if registros:
+                log_info(f"{len(registros)} XMLs reaproveitados do cache.")
+
+            falhas_leitura = set()
+            lote = extrair_dados_lote(
+                pendentes,
+                processos=opcoes.get("processos_xml"),
+                stop_event=stop_event,
+                rapido=opcoes.get("leitura_rapida_xml", True),
+                falhas=falhas_leitura
+            )
+            for idx, (entrada, dados_xml) in enumerate(lote):
+                msg_curta = re.sub(r'\D', "", entrada.nome)
+                if len(msg_curta) > 30: msg_curta = msg_curta[:30] + "..."
+
+                atualizar_status(f"Lendo XML ({idx+1}/{len(pendentes)}): {msg_curta}")
+
+                registros[entrada.id] = dados_xml
+                # Erro de leitura (rede, ZIP) não vai para o cache: o XML é lido de novo na próxima execução
+                if entrada not in falhas_leitura:
+                    novos.append((entrada.id, entrada.tamanho, entrada.mtime, dados_xml))
+
+            if falhas_leitura:
+                log_warn(f"{len(falhas_leitura)} XML(s) não puderam ser lidos (erro de leitura); serão tentados de novo na próxima execução.")
 
-        for idx, nome in enumerate(arquivos_xml):
             if stop_event and stop_event.is_set():
                 log_warn('Cancelado pelo usuário na leitura de XML.')
-                return 
-
-            msg_curta = re.sub(r'\D', "", nome)
-            if len(msg_curta) > 30: msg_curta = msg_curta[:30] + "..."
-            
-            atualizar_status(f"Lendo XML ({idx+1}/{len(arquivos_xml)}): {msg_curta}")
-
-            xml_path = os.path.join(pasta_xml, nome)
-            
-            chave = extrair_chave_cte(xml_path)
-            if not chave or not chave_cte(chave):
-                continue
-                
-            numero_xml = extrair_numero_cte_xml(xml_path)
-            if not numero_xml:
-                continue
-
-            tipo = classificar_cte(xml_path)
-            tem_tag_comp = inf_cte(xml_path)
-            
-            if (tipo != '0' or tem_tag_comp):
-                cte_complemento_qtd += 1
-                gerar_relatorio(numero_xml, 'Ignorado', msg = 'CTe Identificado como Complemento/Anulação')
-                continue
-
-            if numero_xml in mapa_cte:
-                continue
-
-            mapa_cte[numero_xml] = {
-                'chave': chave,
-                'xml': xml_path
-            }
+                salvar_cache_xml(remover_ausentes=False)
+                return resumo()
 
-    log_ok(f"Indexação concluída: {len(mapa_cte)} CT-es válidos.")
+            # Monta o mapa na ordem da pasta: o primeiro XML de cada número prevalece
+            for entrada in arquivos_xml:
+                dados_xml = registros.get(entrada.id)
 
-    if stop_event and stop_event.is_set(): return
+                if not dados_xml:
+                    continue
 
-    # =====================================================
-    # FASE 2: SPLIT E ORGANIZAÇÃO DE PDFs
-    # =====================================================
-    atualizar_status("Iniciando análise de PDFs")
-
-    split_temp = os.path.join(pasta_pdfs, "_split_temp")
-    chaves_validas = {info['chave'] for info in mapa_cte.values()}
-    arquivos_pdf = [p for p in os.listdir(pasta_pdfs) if p.lower().endswith(".pdf")]
+                chave = dados_xml['chave']
+                if not chave or not chave_cte(chave):
+                    continue
+                
+                numero_xml = dados_xml['numero']
+                if not numero_xml:
+                    continue
+
+                if (dados_xml['tipo'] != '0' or dados_xml['complemento']):
+                    cte_complemento_qtd += 1
+                    gerar_relatorio(numero_xml, 'Ignorado', msg = 'CTe Identificado como Complemento/Anulação')
+                    continue
+
+                if numero_xml in mapa_cte:
+                    continue
+
+                mapa_cte[numero_xml] = {
+                    'chave': chave,
+                    'xml': entrada,
+                    'valor': dados_xml['valor']
+                }
+
+            salvar_cache_xml(remover_ausentes=True)
+
+        log_ok(f"Indexação concluída: {len(mapa_cte)} CT-es válidos.")
+        diario.registrar_fase("xml", ctes=len(mapa_cte))
+
+        if stop_event and stop_event.is_set(): return resumo()
+
+        # =====================================================
+        # FASE 2: SPLIT E ORGANIZAÇÃO DE PDFs
+        # =====================================================
+        atualizar_status("Iniciando análise de PDFs")
+        from .pdf_utils import LocalizadorPDF, mapear_paginas_por_cte
+
+        chaves_validas = {info['chave'] for info in mapa_cte.values()}
+        contadores_paginas = {}
+        arquivos_pdf = inventario.listar(pasta_pdfs, ".pdf")
+        localizador = LocalizadorPDF()
+        pendentes_pdf = []
+        salvas = None
+
+        def abrir_cache_barcode():
+            if not opcoes.get("cache_barcode"):
+                return None
+            return CacheBarcode(CACHE_BARCODE, opcoes.get("cache_barcode_max_paginas", 500000))
+
+        def log_paginas_lidas():
+            log_info(
+                f"Páginas lidas: {contadores_paginas.get('texto', 0)} pelo texto, "
+                f"{contadores_paginas.get('barcode', 0)} pelo código de barras, "
+                f"{contadores_paginas.get('sem_chave', 0)} sem chave, "
+                f"{contadores_paginas.get('cache', 0)} reaproveitadas do cache."
+            )
+            if contadores_paginas.get("raster_qtd"):
+                media_kb = contadores_paginas["raster_bytes"] / contadores_paginas["raster_qtd"] / 1024
+                pico_kb = contadores_paginas["raster_pico"] / 1024
+                log_info(f"Memória por renderização: média {media_kb:.0f} KB, pico {pico_kb:.0f} KB.")
     
-    if arquivos_pdf:
-        for pdf in arquivos_pdf:
-            if stop_event and stop_event.is_set():
-                log_warn('Cancelado durante leitura de PDF')
-                return 
-
-            caminho = os.path.join(pasta_pdfs, pdf)
+        if arquivos_pdf:
+            cache_barcode = None
             try:
-                if len(PdfReader(caminho).pages) > 0:
-                    split_pdf_por_cte(
-                        caminho, 
-                        split_temp, 
+                # PDFs já divididos, com a chave no nome, dispensam a leitura
+                pendentes_pdf = localizador.indexar_nomes(arquivos_pdf, chaves_validas)
+                if len(pendentes_pdf) < len(arquivos_pdf):
+                    log_info(f"{len(arquivos_pdf) - len(pendentes_pdf)} PDFs identificados pelo nome.")
+
+                # Páginas já localizadas pela execução retomada (mesmos PDFs)
+                salvas = diario.paginas_salvas(arquivos_pdf, chaves_validas) if diario.retomado else None
+                if salvas is not None:
+                    for chave, (entrada, i) in salvas.items():
+                        localizador.registrar(chave, entrada, i)
+                    pendentes_pdf = []
+                    log_info(f"{len(salvas)} páginas reaproveitadas da execução anterior.")
+
+                # Em pipeline, as páginas são lidas junto com o carimbo (fase 4)
+                elif not pipeline:
+                    try:
+                        cache_barcode = abrir_cache_barcode()
+                    except Exception as e:
+                        log_warn(f"Cache de leitura de PDF indisponível: {e}")
+
+                    paginas = mapear_paginas_por_cte(
+                        pendentes_pdf, 
                         chaves_validas, 
                         log_info, 
                         status_callback=atualizar_status,
-                        stop_event=stop_event
+                        stop_event=stop_event,
+                        recorte=opcoes.get("recorte_barcode"),
+                        usar_texto=opcoes.get("chave_por_texto", True),
+                        contadores=contadores_paginas,
+                        processos=opcoes.get("processos_paginas", 0),
+                        localizador=localizador,
+                        cache=cache_barcode
                     )
+                    if not (stop_event and stop_event.is_set()):
+                        diario.registrar_paginas(arquivos_pdf, chaves_validas, paginas)
             except Exception as e:
-                log_warn(f'Erro ao abrir PDF {pdf}: {e}')
-    else:
-        log_warn("Nenhum PDF encontrado na pasta.")
-
-    if stop_event and stop_event.is_set(): return
+                log_warn(f'Erro na leitura dos PDFs: {e}')
+            finally:
+                if cache_barcode:
+                    cache_barcode.fechar()
 
-    pdf_base = split_temp if os.path.isdir(split_temp) else pasta_pdfs
+            if stop_event and stop_event.is_set():
+                log_warn('Cancelado durante leitura de PDF')
+                return resumo()
 
-    # =====================================================
-    # FASE 3: LEITURA DA PLANILHA
-    # =====================================================
-    atualizar_status("Carregando Planilha Excel")
-    try:
-        df = read_excel(planilha)
-        grupos = df.groupby("N° CT-e")
-        total_cte = len(grupos)
-        if progresso: progresso["maximum"] = total_cte
-        log_ok(f"Planilha carregada: {total_cte} grupos.")
-    except Exception as e:
-        log_err(f"Erro no Excel: {e}")
-        return
-
-    # =====================================================
-    # FASE 4: PROCESSAMENTO
-    # =====================================================
-    pdf_unico_writer = PdfWriter() if pdf_unico else None
-
-    for i, (ncte, grupo) in enumerate(grupos, start=1):
-        if stop_event and stop_event.is_set():
-            log_warn('Processamento interrompido pelo usuário')
-            if os.path.isdir(split_temp):
-                try: shutil.rmtree(split_temp)
-                except: pass
-            return 
+            if not pipeline and salvas is None:
+                log_paginas_lidas()
+        else:
+            log_warn("Nenhum PDF encontrado na pasta.")
 
+        if stop_event and stop_event.is_set(): return resumo()
 
-        
-        if progresso: progresso["value"] = i
-        
-        ncte_str = str(int(ncte))
-        atualizar_status(f"Rateando CT-e {ncte_str} ({i}/{total_cte})")
-        info_cte = mapa_cte.get(ncte_str)
-
-        if not info_cte:
-            erros_chave += 1
-            lista_erros_chave.append(ncte_str)
-            log_err(f"CT-e {ncte_str}: XML ausente.")
-            gerar_relatorio(numero_xml, 'Erro', msg = 'XML não encontrado na pasta')
-            continue
-
-        chave = info_cte['chave']
-        xml_path = info_cte['xml']
-        pdf = localizar_pdf(pdf_base, chave)
-
-        if not pdf:
-            erros_pdf += 1
-            lista_erros_pdf.append(ncte_str)
-            log_err(f"CT-e {ncte_str}: PDF ausente (Não encontrado na varredura).")
-            gerar_relatorio(numero_xml, 'Erro', msg = 'PDF não encontrado ou código não legível')
-            continue
+        # =====================================================
+        # FASE 3: LEITURA DA PLANILHA
+        # =====================================================
+        atualizar_status("Carregando Planilha Excel")
+        from .planilha import ler_planilha_em_blocos, agrupar_em_fluxo
 
+        contadores_planilha = {"descartadas": 0}
         try:
-            valores = []
-            linhas = []
-            valor_cte = extrair_valor_total_cte(xml_path)
-
-            for _, r in grupo.iterrows():
-                base = converter_moeda_para_decimal(r.get("Vlr Contabil"))
-                if not base or base <= 0: continue
-                
-                base = base.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-                prefixo = identificar_prefixo_oper(str(r.get("Operação", "")))
-                
-                if prefixo:
-                    linhas.append({"prefixo": prefixo, "valor": base})
-                    valores.append(base)
-
-
-            soma_planilha = sum(valores).quantize(Decimal('0.01'), rounding =ROUND_HALF_UP) if valores else Decimal('0.00')
-
-            if valor_cte:
-                diferenca = (valor_cte - soma_planilha).quantize(Decimal("0.01"))
-                if diferenca != Decimal("0.00") and abs(diferenca) <= Decimal("0.01"):
-                    if linhas:
-                        min(linhas, key=lambda x: x["valor"])["valor"] += diferenca
-                        soma_planilha += diferenca
+            if em_blocos:
+                # Um CT-e por vez, direto do arquivo (precisa estar ordenado por CT-e)
+                grupos = agrupar_em_fluxo(
+                    ler_planilha_em_blocos(
+                        planilha,
+                        tamanho_bloco=opcoes["linhas_por_bloco"],
+                        sep=opcoes["csv_separador"],
+                        encoding=opcoes["csv_encoding"],
+                    ),
+                    contadores_planilha,
+                )
+                log_info("Planilha lida em blocos.")
+            else:
+                if leitura_planilha:
+                    grupos, contadores_planilha["descartadas"] = grupos_futuros.result()
+                else:
+                    grupos, contadores_planilha["descartadas"] = carregar_grupos()
+                log_ok(f"Planilha carregada: {len(grupos)} grupos.")
+        except Exception as e:
+            log_err(f"Erro no Excel: {e}")
+            return resumo()
+
+        # =====================================================
+        # FASE 4: PROCESSAMENTO
+        # =====================================================
+        from .pdf_utils import (
+            SaidaUnificada,
+            carimbar_lote,
+            carimbar_fluxo,
+            criar_motor_carimbo,
+            ler_pagina,
+            paginas_em_fluxo
+        )
+        from .moeda import para_centavos, de_centavos, formato_centavos, ratear, ratear_grupos
+
+        saida_unificada = None
+        if pdf_unico:
+            ts = datetime.now().strftime("%Y-%m-%d_%H-%M")
+            saida_unificada = SaidaUnificada(
+                pasta_saida, f"CTE_UNIFICADO_{ts}",
+                max_paginas=opcoes["pdf_unico_max_paginas"],
+                max_bytes=int(opcoes["pdf_unico_max_mb"] * 1024 * 1024),
+            )
+        try:
+            modelo_etiqueta = criar_motor_carimbo(opcoes["motor_carimbo"])
+        except ValueError as e:
+            log_err(str(e))
+            return resumo()
+
+        # Preparação: valida cada grupo e monta o texto da etiqueta, na
+        # ordem da planilha; os logs e o relatório saem no consumo abaixo
+        atualizar_status("Preparando rateio dos CT-es")
+        itens = []
+        aguardando = {}  # pipeline: chave -> posição do CT-e cuja página ainda não apareceu
+        rateio_proporcional = opcoes["rateio_proporcional"]
+        tolerancia_rateio = opcoes["rateio_tolerancia_centavos"]
+        total_cte = 0
+
+        def preparar(ncte_str, linhas_planilha, indice):
+            """Item do CT-e (posição indice na planilha); 'total' marca os que precisam de rateio"""
+            item = {'ncte': ncte_str}
+
+            # Já gravado pela execução retomada (com o PDF intacto na saída)
+            registro = diario.concluido(ncte_str) if diario.retomado else None
+            if registro:
+                item['retomado'] = registro
+                return item
+
+            info_cte = mapa_cte.get(ncte_str)
+            if not info_cte:
+                item['erro'] = 'xml'
+                return item
+
+            chave = info_cte['chave']
+            pagina_pdf = localizador.localizar(chave)
+            if not pagina_pdf:
+                if not pipeline:
+                    item['erro'] = 'pdf'
+                    return item
+                # A página ainda pode aparecer na leitura dos PDFs
+                aguardando[chave] = indice
+                item['aguardando'] = True
+
+            if not linhas_planilha:
+                item['erro'] = 'linhas'
+                return item
 
-            if not linhas:
+            try:
+                soma_planilha = sum(centavos for _, centavos in linhas_planilha)
+                total_xml = para_centavos(info_cte['valor']) if info_cte['valor'] else 0
+            except Exception as e:
+                item['erro'] = 'critico'
+                item['trace'] = traceback.format_exc()
+                item['excecao'] = e
+                return item
+
+            # Linhas que somam zero (ex.: "0,004") não servem de peso para o rateio
+            if soma_planilha <= 0:
+                item['erro'] = 'linhas'
+                return item
+
+            item.update(info=info_cte, soma=soma_planilha, linhas=linhas_planilha,
+                        arquivo=f"{chave}-procCTe_rateado.pdf", pagina=pagina_pdf)
+
+            # Rateio do vTPrest pelos valores da planilha (maiores restos): as
+            # linhas somam exatamente o CT-e. Sem rateio_proporcional, só
+            # diferenças de até 1 centavo são redistribuídas, como antes
+            diferenca = total_xml - soma_planilha
+            if total_xml > 0 and diferenca and (rateio_proporcional or abs(diferenca) <= 1):
+                item['total'] = total_xml
+                if abs(diferenca) > tolerancia_rateio:
+                    item['diferenca'] = diferenca
+            return item
+
+        def montar_etiqueta(item):
+            """Texto da etiqueta e tarefa de carimbo, com as linhas já rateadas"""
+            if 'linhas' not in item:
+                return
+            texto = [f"{prefixo}: R$ {formato_centavos(v)}" for prefixo, v in item['linhas']]
+            item['texto'] = "\n".join(texto)
+            if item['pagina']:
+                origem, indice = item['pagina']
+                item['tarefa'] = (origem, indice, item['texto'],
+                                  os.path.join(pasta_saida, item['arquivo']))
+
+        def avisar_planilha():
+            diario.registrar_fase("planilha", grupos=total_cte)
+            if em_blocos:
+                log_ok(f"Planilha carregada: {total_cte} grupos.")
+            if contadores_planilha["descartadas"]:
+                log_warn(f"{contadores_planilha['descartadas']} linha(s) com N° CT-e inválido ignorada(s).")
+
+        if not em_blocos:
+            for ncte_str, linhas_planilha in grupos:
+                itens.append(preparar(ncte_str, linhas_planilha, len(itens)))
+
+            total_cte = len(itens)
+            if progresso: progresso["maximum"] = total_cte
+            avisar_planilha()
+
+            a_ratear = [item for item in itens if 'total' in item]
+            partes = ratear_grupos(
+                [item['total'] for item in a_ratear],
+                [[centavos for _, centavos in item['linhas']] for item in a_ratear],
+            )
+            for item, valores in zip(a_ratear, partes):
+                item['linhas'] = [(prefixo, v) for (prefixo, _), v in zip(item['linhas'], valores)]
+
+            for item in itens:
+                montar_etiqueta(item)
+
+        def concluir(i, item, resultado=None):
+            """Log, relatório, PDF unificado e XML processado de um CT-e, na ordem da planilha"""
+            nonlocal sucesso, erros_chave, erros_pdf
+
+            if progresso: progresso["value"] = i
+
+            ncte_str = item['ncte']
+            atualizar_status(f"Rateando CT-e {ncte_str} ({i}/{total_cte})")
+            erro = item.get('erro')
+
+            if 'retomado' in item:
+                registro = item['retomado']
+                if saida_unificada:
+                    pagina_salva = ler_pagina(os.path.join(pasta_saida, registro['arquivo']))
+                    saida_unificada.adicionar(pagina_salva, registro['tamanho'])
+                sucesso += 1
+                log_ok(f"CT-e {ncte_str} já gravado na execução anterior.")
+                gerar_relatorio(ncte_str,
+                                 registro.get('status', 'Sucesso'),
+                                 valor_xml= registro['valor_xml'],
+                                 valor_planilha = registro['valor_planilha'],
+                                 msg= registro.get('mensagem', 'Processado com Sucesso!'),
+                                 arquivos= registro['arquivo'])
+                return
+
+            if erro == 'xml':
+                erros_chave += 1
+                lista_erros_chave.append(ncte_str)
+                log_err(f"CT-e {ncte_str}: XML ausente.")
+                gerar_relatorio(ncte_str, 'Erro', msg = 'XML não encontrado na pasta')
+                return
+
+            if erro == 'pdf':
+                erros_pdf += 1
+                lista_erros_pdf.append(ncte_str)
+                log_err(f"CT-e {ncte_str}: PDF ausente (Não encontrado na varredura).")
+                gerar_relatorio(ncte_str, 'Erro', msg = 'PDF não encontrado ou código não legível')
+                return
+
+            if erro == 'linhas':
                 log_warn(f"CT-e {ncte_str}: Sem linhas válidas na planilha.")
-                gerar_relatorio(numero_xml, 'Erro', msg = 'Nenhuma linha válida encontrada')
-                continue
+                gerar_relatorio(ncte_str, 'Erro', msg = 'Nenhuma linha válida encontrada')
+                return
 
-            texto = [f"{l['prefixo']}: R$ {formato_brl(l['valor'])}" for l in linhas]
-            
-            overlay = os.path.join(pasta_saida, f"{ncte}_overlay.pdf")
-            nome_final = os.path.basename(pdf).replace(".pdf", "_rateado.pdf").replace("_procCTe_rateado.pdf", "_rateado.pdf")
-            saida = os.path.join(pasta_saida, nome_final)
+            if erro == 'critico':
+                log_err(f"Erro CT-e {ncte_str}:\n{item['trace']}")
+                gerar_relatorio(ncte_str, 'Erro Crítico', msg = str(item['excecao']))
+                return
 
-            criar_overlay("\n".join(texto), overlay)
-            sobrepor_pdf(pdf, overlay, saida)
+            pagina_carimbada, tamanho, erro_carimbo = resultado
+            if erro_carimbo:
+                log_err(f"Erro CT-e {ncte_str}:\n{erro_carimbo}")
+                gerar_relatorio(ncte_str, 'Erro Crítico', msg = erro_carimbo)
+                return
 
-            if pdf_unico and pdf_unico_writer:
-                rd = PdfReader(saida)
-                for p in rd.pages: pdf_unico_writer.add_page(p)
+            if saida_unificada and pagina_carimbada is not None:
+                saida_unificada.adicionar(pagina_carimbada, tamanho)
 
             sucesso += 1
             log_ok(f"CT-e {ncte_str} processado.")
-            
-            gerar_relatorio(numero_xml,
-                             'Sucesso', 
-                             valor_xml= valor_cte, 
-                             valor_planilha = soma_planilha, 
-                             msg= 'Processado com Sucesso!', 
-                             arquivos= nome_final)
-            
+
+            status, mensagem = 'Sucesso', 'Processado com Sucesso!'
+            if 'diferenca' in item:
+                # Rateio fecha com o vTPrest, mas a planilha não batia com o XML
+                diferenca_brl = formato_centavos(item['diferenca'])
+                log_warn(f"CT-e {ncte_str}: planilha difere do XML em R$ {diferenca_brl}; diferença rateada entre as linhas.")
+                status = 'Sucesso com Diferença'
+                mensagem = f'Diferença de R$ {diferenca_brl} entre XML e planilha rateada entre as linhas'
+        
+            gerar_relatorio(ncte_str,
+                             status, 
+                             valor_xml= item['info']['valor'], 
+                             valor_planilha = de_centavos(item['soma']), 
+                             msg= mensagem, 
+                             arquivos= item['arquivo'])
+            diario.registrar_cte(ncte_str, item['arquivo'], tamanho,
+                                 item['info']['valor'], de_centavos(item['soma']), item['linhas'],
+                                 status=status, mensagem=mensagem)
+        
+            # XMLs lidos de dentro de um ZIP permanecem no arquivo original
+            xml_entrada = item['info']['xml']
+            xml_path = xml_entrada.caminho if not xml_entrada.membro else None
             if mover_xml and xml_path and os.path.exists(xml_path):
                 try:
                     pasta_processados = os.path.join(os.path.dirname(xml_path), "XML Processados")
@@ -272,55 +577,258 @@ def processar(
                 except Exception as e_move:
                     log_warn(f"Não foi possível mover o XML: {e_move}")
 
-        except Exception as e:
-            trace = traceback.format_exc()
-            log_err(f"Erro CT-e {ncte_str}:\n{trace}")
-            gerar_relatorio(ncte_str, 'Erro Crítico', msg = 'str{e}')
-
-    # =====================================================
-    # FINALIZAÇÃO
-    # =====================================================
-    if pdf_unico and pdf_unico_writer and not (stop_event and stop_event.is_set()):
-        atualizar_status("Gerando PDF Unificado.")
-        from datetime import datetime
-        ts = datetime.now().strftime("%Y-%m-%d_%H-%M")
-        nome = f"CTE_UNIFICADO_{ts}.pdf"
-        with open(os.path.join(pasta_saida, nome), "wb") as f:
-            pdf_unico_writer.write(f)
-        log_info(f"PDF Unificado: {nome}")
-
-    if os.path.isdir(split_temp):
-        try: shutil.rmtree(split_temp, ignore_errors=True)
-        except: pass
-
-    if dados_excel:
-        atualizar_status('Gerando arquivo Excel')
-        try:
-            ts = datetime.now().strftime('%Y-%m-%d %H-%M-%S')
-            nome_excel = f'Relatório_Rateio{ts}.xlsx'
-            caminho_excel = os.path.join(pasta_saida, nome_excel)
+        if em_blocos:
+            # Leitura em blocos: cada CT-e é rateado, carimbado e concluído assim
+            # que sai da planilha; só ficam na memória os que aguardam o carimbo
+            atualizar_status("Rateando os CT-es da planilha")
+            fila = deque()
+            erro_planilha = []
 
+            def tarefas_da_planilha():
+                nonlocal total_cte
+                try:
+                    for ncte_str, linhas_planilha in grupos:
+                        item = preparar(ncte_str, linhas_planilha, total_cte)
+                        total_cte += 1
+                        if progresso: progresso["maximum"] = total_cte
+                        if 'total' in item:
+                            valores = ratear(item['total'], [centavos for _, centavos in item['linhas']])
+                            item['linhas'] = [(prefixo, v) for (prefixo, _), v in zip(item['linhas'], valores)]
+                        montar_etiqueta(item)
+                        fila.append(item)
+                        yield (item, item['tarefa']) if 'tarefa' in item else None
+                except Exception as e:
+                    erro_planilha.append(e)
+
+            concluidos = 0
+
+            def avancar():
+                """Conclui, na ordem da planilha, os CT-es da frente da fila que já têm resultado"""
+                nonlocal concluidos
+                while fila and ('tarefa' not in fila[0] or 'carimbo' in fila[0]):
+                    if stop_event and stop_event.is_set():
+                        return
+                    item = fila.popleft()
+                    concluidos += 1
+                    concluir(concluidos, item, item.get('carimbo'))
+
+            fluxo = tarefas_da_planilha()
+            carimbos = carimbar_fluxo(
+                fluxo,
+                processos=opcoes["processos_carimbo"],
+                stop_event=stop_event,
+                modelo=modelo_etiqueta,
+                motor=opcoes["motor_carimbo"],
+                devolver_paginas=pdf_unico,
+            )
 
-            df_rel = pd.DataFrame(dados_excel)
-            df_rel.to_excel(caminho_excel, index = False)
-            log_info(f'Arquivo Excel Gerado: {nome_excel}')
-        except Exception as f:
-            log_err(f'Não foi possível salvar o arquivo {nome_excel}\nNºErr: {f}')
+            try:
+                for recebido in carimbos:
+                    if stop_event and stop_event.is_set():
+                        break
+                    if recebido is not None:
+                        item, pagina_carimbada, tamanho, erro_carimbo = recebido
+                        item['carimbo'] = (pagina_carimbada, tamanho, erro_carimbo)
+                    avancar()
+
+                if stop_event and stop_event.is_set():
+                    log_warn('Processamento interrompido pelo usuário')
+                    return resumo()
+                avancar()
+            finally:
+                carimbos.close()
+                fluxo.close()
+                modelo_etiqueta.fechar()
+
+            if erro_planilha:
+                log_err(f"Erro no Excel: {erro_planilha[0]}")
+                return resumo()
+            avisar_planilha()
+
+        elif not pipeline:
+            # Carimbo e gravação (em paralelo conforme processos_carimbo),
+            # consumidos na ordem da planilha
+            carimbos = carimbar_lote(
+                [item['tarefa'] for item in itens if 'tarefa' in item],
+                processos=opcoes["processos_carimbo"],
+                stop_event=stop_event,
+                modelo=modelo_etiqueta,
+                devolver_paginas=pdf_unico,
+                motor=opcoes["motor_carimbo"],
+            )
+
+            try:
+                for i, item in enumerate(itens, start=1):
+                    if stop_event and stop_event.is_set():
+                        log_warn('Processamento interrompido pelo usuário')
+                        return resumo()
+
+                    resultado = None
+                    if 'tarefa' in item:
+                        resultado = next(carimbos, None)
+                        if resultado is None:
+                            # Gerador encerrado pelo stop_event
+                            log_warn('Processamento interrompido pelo usuário')
+                            return resumo()
+
+                    concluir(i, item, resultado)
+            finally:
+                carimbos.close()
+                modelo_etiqueta.fechar()
+        else:
+            # Pipeline: os PDFs são lidos numa thread e cada CT-e é carimbado
+            # assim que a página aparece; o relatório, o PDF unificado e os
+            # logs continuam saindo na ordem da planilha
+            atualizar_status("Lendo PDFs e carimbando os CT-es encontrados")
+
+            def tarefas_em_fluxo():
+                # Páginas já conhecidas (PDFs identificados pelo nome) vão primeiro
+                for indice, item in enumerate(itens):
+                    if 'tarefa' in item:
+                        yield indice, item['tarefa']
+
+                # Procura todas as chaves válidas, como o mapear_paginas_por_cte,
+                # para o diário guardar o mapa completo
+                encontradas = {}
+                achados = paginas_em_fluxo(
+                    pendentes_pdf,
+                    chaves_validas,
+                    log_info,
+                    stop_event=stop_event,
+                    recorte=opcoes.get("recorte_barcode"),
+                    usar_texto=opcoes.get("chave_por_texto", True),
+                    contadores=contadores_paginas,
+                    processos=opcoes.get("processos_paginas", 0),
+                    abrir_cache=abrir_cache_barcode,
+                )
+                try:
+                    for achado in achados:
+                        if achado is None:
+                            yield None
+                            continue
+                        chave, entrada, pagina = achado
+                        encontradas[chave] = (entrada, pagina)
+                        indice = aguardando.pop(chave, None)
+                        if indice is None:
+                            continue
+                        item = itens[indice]
+                        item['aguardando'] = False
+                        if 'texto' not in item:
+                            continue
+                        item['tarefa'] = (entrada, pagina, item['texto'],
+                                          os.path.join(pasta_saida, item['arquivo']))
+                        yield indice, item['tarefa']
+                finally:
+                    achados.close()
+
+                if stop_event and stop_event.is_set():
+                    return
+                if arquivos_pdf and salvas is None:
+                    log_paginas_lidas()
+                    diario.registrar_paginas(arquivos_pdf, chaves_validas, encontradas)
+                # Leitura terminada: o que não apareceu não tem PDF
+                for indice in aguardando.values():
+                    item = itens[indice]
+                    item['aguardando'] = False
+                    item['erro'] = 'pdf'
+                aguardando.clear()
+
+            proximo = 0
+
+            def avancar():
+                """Conclui, na ordem da planilha, os CT-es que já têm resultado"""
+                nonlocal proximo
+                while proximo < total_cte:
+                    if stop_event and stop_event.is_set():
+                        return
+                    item = itens[proximo]
+                    if item.get('aguardando') or ('tarefa' in item and 'carimbo' not in item):
+                        return
+                    proximo += 1
+
+                    concluir(proximo, item, item.pop('carimbo', None))
+
+            fluxo = tarefas_em_fluxo()
+            carimbos = carimbar_fluxo(
+                fluxo,
+                processos=opcoes["processos_carimbo"],
+                stop_event=stop_event,
+                modelo=modelo_etiqueta,
+                quantidade=sum('texto' in item for item in itens),
+                motor=opcoes["motor_carimbo"],
+                devolver_paginas=pdf_unico,
+            )
+
+            try:
+                for recebido in carimbos:
+                    if stop_event and stop_event.is_set():
+                        break
+                    if recebido is not None:
+                        indice, pagina_carimbada, tamanho, erro_carimbo = recebido
+                        itens[indice]['carimbo'] = (pagina_carimbada, tamanho, erro_carimbo)
+                    avancar()
+
+                if stop_event and stop_event.is_set():
+                    log_warn('Processamento interrompido pelo usuário')
+                    return resumo()
+                avancar()
+            finally:
+                carimbos.close()
+                fluxo.close()
+                modelo_etiqueta.fechar()
+
+        # =====================================================
+        # FINALIZAÇÃO
+        # =====================================================
+        if saida_unificada and not (stop_event and stop_event.is_set()):
+            atualizar_status("Gerando PDF Unificado.")
+            arquivos_unificados = saida_unificada.fechar()
+            for nome in arquivos_unificados:
+                log_info(f"PDF Unificado: {nome}")
+
+
+        if dados_excel:
+            atualizar_status('Gerando arquivo Excel')
+            try:
+                ts = datetime.now().strftime('%Y-%m-%d %H-%M-%S')
+                nome_excel = f'Relatório_Rateio{ts}.xlsx'
+                caminho_excel = os.path.join(pasta_saida, nome_excel)
 
-    tempo_total_seg = time.time() - tempo_inicial
-    minutos = int(tempo_total_seg // 60)
-    segundos = int(tempo_total_seg % 60)
-    
-    if minutos > 0:
-        texto_tempo = f'{minutos}m {segundos}s'
-    else:
-        texto_tempo = f'{round(tempo_total_seg,2)}s'
 
+                import pandas as pd
 
+                df_rel = pd.DataFrame(dados_excel)
+                df_rel.to_excel(caminho_excel, index = False)
+                log_info(f'Arquivo Excel Gerado: {nome_excel}')
+            except Exception as f:
+                caminho_excel = None
+                log_err(f'Não foi possível salvar o arquivo {nome_excel}\nNºErr: {f}')
 
-    print(mapa_cte)
-    atualizar_status("Processamento Concluído!")
-    logger_func("-" * 30)
-    log_ok(f"SUCESSO: {sucesso} | ERROS: {erros_chave + erros_pdf}")
-    if cte_complemento_qtd: log_info(f"Complementos ignorados: {cte_complemento_qtd}")
-    logger_func(f"⏱️ Tempo: {texto_tempo}")
\ No newline at end of file
+        tempo_total_seg = time.time() - tempo_inicial
+        minutos = int(tempo_total_seg // 60)
+        segundos = int(tempo_total_seg % 60)
+    
+        if minutos > 0:
+            texto_tempo = f'{minutos}m {segundos}s'
+        else:
+            texto_tempo = f'{round(tempo_total_seg,2)}s'
+
+        atualizar_status("Processamento Concluído!")
+        logger_func("-" * 30)
+        log_ok(f"SUCESSO: {sucesso} | ERROS: {erros_chave + erros_pdf}")
+        if cte_complemento_qtd: log_info(f"Complementos ignorados: {cte_complemento_qtd}")
+        logger_func(f"⏱️ Tempo: {texto_tempo}")
+        diario.finalizar()
+        return resumo(concluido=True)
+    finally:
+        if leitura_planilha:
+            leitura_planilha.shutdown(wait=False, cancel_futures=True)
+        if diario:
+            diario.fechar()
+            if diario.erro:
+                log_warn(f"Diário de execução indisponível: {diario.erro}")
+        # pdf_utils só existe se a fase 2 chegou a rodar
+        pdf_utils = sys.modules.get(f"{__package__}.pdf_utils")
+        if pdf_utils:
+            pdf_utils.fechar_leitores()
+        fechar_zips()
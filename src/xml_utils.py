@@ -1,8 +1,15 @@
+import io
 import os
 import re
-from decimal import Decimal, ROUND_HALF_UP
+import mmap
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 import xml.etree.ElementTree as ET
 
+from .arquivos import Entrada, ler_bytes
+
 
 # =====================================================
 # CHAVE CT-e
@@ -27,16 +34,24 @@ def extract_cte_number_from_chave(chave: str):
 # LOCALIZAÇÃO DE XML
 # =====================================================
 
-def localizar_xml_por_chave(chave: str, pasta: str):
+def localizar_xml_por_chave(chave: str, pasta: str, inventario=None) -> Entrada | None:
     """
-    Localiza o arquivo XML correspondente à chave CT-e.
+    Localiza o XML correspondente à chave CT-e e retorna sua Entrada.
+    Com um Inventario, a busca é feita no índice, sem listar a pasta
+    (e pode achar membros de ZIP).
     """
+    if inventario is not None:
+        entradas = inventario.buscar_chave(chave, ".xml") if chave else []
+        return entradas[0] if entradas else None
+
     if not chave or not os.path.isdir(pasta):
         return None
 
-    for nome in os.listdir(pasta):
-        if nome.lower().endswith(".xml") and chave in nome:
-            return os.path.join(pasta, nome)
+    with os.scandir(pasta) as it:
+        for item in it:
+            if item.name.lower().endswith(".xml") and chave in item.name and item.is_file():
+                st = item.stat()
+                return Entrada(item.path, None, st.st_size, st.st_mtime_ns)
 
     return None
 
@@ -149,4 +164,217 @@ def inf_cte(xml_path:str) -> bool:
         return False
 
     except Exception:
-        return False
\ No newline at end of file
+        return False
+
+# =====================================================
+# EXTRAÇÃO EM PASSADA ÚNICA
+# =====================================================
+
+# Blocos de infCte que aparecem depois de vPrest: ao encontrá-los
+# todos os campos do registro já foram lidos.
+_TAGS_FINAIS = ("infCTeNorm", "infCteComp", "infCteAnu")
+
+
+def _nome_local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+# Leitura direta dos bytes para o layout padrão da SEFAZ (procCTe sem prefixos)
+_RE_ID = re.compile(rb'<infCte\b[^>]*?\bId="CTe(\d{44})"')
+_RE_NCT = re.compile(rb'<nCT>\s*(\d+)\s*</nCT>')
+_RE_TPCTE = re.compile(rb'<tpCTe>\s*(\d)\s*</tpCTe>')
+_RE_VTPREST = re.compile(rb'<vTPrest>\s*(\d+(?:\.\d+)?)\s*</vTPrest>')
+_RE_TAG_FINAL = re.compile(rb'<(infCTeNorm|infCteComp|infCteAnu)[\s>/]')
+
+
+def _busca_unica(regex, dados):
+    """
+    Retorna o grupo do único casamento da regex; None se houver zero ou mais de um.
+    """
+    achado = regex.search(dados)
+    if achado is None or regex.search(dados, achado.end()) is not None:
+        return None
+    return achado.group(1)
+
+
+def _extrair_dados_bytes(dados) -> dict | None:
+    """
+    Lê os campos do CT-e direto dos bytes. Retorna None quando o
+    documento não tem o formato esperado (o chamador usa o parser completo).
+    """
+    campos = [_busca_unica(r, dados) for r in (_RE_ID, _RE_NCT, _RE_TPCTE, _RE_VTPREST)]
+    if any(c is None for c in campos):
+        return None
+
+    final = _RE_TAG_FINAL.search(dados)
+    if final is None:
+        return None
+
+    chave, numero, tipo, valor = (c.decode("ascii") for c in campos)
+    return {
+        "chave": chave,
+        "numero": numero.lstrip("0"),
+        "tipo": tipo,
+        "complemento": final.group(1) == b"infCteComp",
+        "valor": Decimal(valor).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    }
+
+
+def _extrair_dados_mmap(xml_path: str) -> dict | None:
+    with open(xml_path, "rb") as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as dados:
+                return _extrair_dados_bytes(dados)
+        except ValueError:
+            # Arquivo vazio (o mmap não aceita tamanho 0)
+            return None
+
+
+def _extrair_dados(xml_path, rapido: bool = True) -> dict | None:
+    """
+    Como extrair_dados_cte, mas falhas de leitura (arquivo sumiu,
+    erro de rede, ZIP ilegível) sobem como exceção: None fica só para
+    o XML que foi lido e não é um CT-e válido.
+    """
+    conteudo = None
+    if isinstance(xml_path, Entrada):
+        if xml_path.membro:
+            conteudo = ler_bytes(xml_path)
+        else:
+            xml_path = xml_path.caminho
+
+    if conteudo is None:
+        if not xml_path:
+            return None
+        if not os.path.exists(xml_path):
+            raise FileNotFoundError(xml_path)
+
+    if rapido:
+        if conteudo is not None:
+            dados = _extrair_dados_bytes(conteudo)
+        else:
+            dados = _extrair_dados_mmap(xml_path)
+        if dados is not None:
+            return dados
+
+    origem = io.BytesIO(conteudo) if conteudo is not None else xml_path
+
+    dados = {
+        "chave": None,
+        "numero": None,
+        "tipo": None,
+        "complemento": False,
+        "valor": None
+    }
+
+    try:
+        for evento, elem in ET.iterparse(origem, events=("start", "end")):
+            tag = _nome_local(elem.tag)
+
+            if evento == "start":
+                if tag == "infCte" and dados["chave"] is None:
+                    dados["chave"] = elem.get("Id", "").replace("CTe", "")
+                elif tag in _TAGS_FINAIS:
+                    dados["complemento"] = tag == "infCteComp"
+                    break
+                continue
+
+            if tag == "nCT" and dados["numero"] is None and elem.text:
+                dados["numero"] = elem.text.strip().lstrip("0")
+            elif tag == "tpCTe" and dados["tipo"] is None and elem.text:
+                dados["tipo"] = elem.text.strip()
+            elif tag == "vTPrest" and dados["valor"] is None and elem.text:
+                try:
+                    dados["valor"] = Decimal(elem.text.strip()).quantize(
+                        Decimal("0.01"),
+                        rounding=ROUND_HALF_UP
+                    )
+                except InvalidOperation:
+                    pass
+
+            elem.clear()
+
+    except OSError:
+        raise
+    except Exception:
+        return None
+
+    return dados
+
+
+def extrair_dados_cte(xml_path, rapido: bool = True) -> dict | None:
+    """
+    Lê o XML do CT-e uma única vez e retorna um registro com
+    chave, número (nCT), tipo (tpCTe), se é complemento (infCteComp)
+    e valor total (vTPrest).
+    Aceita um caminho ou uma Entrada (inclusive membro de ZIP).
+    Com rapido=True tenta primeiro a leitura direta dos bytes; se o
+    documento fugir do layout padrão, usa o iterparse, que é
+    interrompido assim que todos os campos são encontrados.
+    """
+    try:
+        return _extrair_dados(xml_path, rapido)
+    except Exception:
+        return None
+
+
+def _extrair_dados_ou_falha(xml_path, rapido: bool = True):
+    """(dados, falhou na leitura) de um XML, para o pool de extrair_dados_lote"""
+    try:
+        return _extrair_dados(xml_path, rapido), False
+    except Exception:
+        return None, True
+
+
+# No Windows, o ProcessPoolExecutor não aceita mais de 61 processos
+# (limite do WaitForMultipleObjects)
+MAX_PROCESSOS_WINDOWS = 61
+
+
+def processos_pool(processos: int | None) -> int:
+    """
+    Número de processos de um pool: None ou 0 usa todos os núcleos;
+    no Windows, limitado a MAX_PROCESSOS_WINDOWS.
+    """
+    if not processos or processos <= 0:
+        processos = os.cpu_count() or 1
+    if sys.platform == "win32":
+        processos = min(processos, MAX_PROCESSOS_WINDOWS)
+    return processos
+
+
+def extrair_dados_lote(caminhos, processos: int | None = None, stop_event=None,
+                       minimo_paralelo: int = 200, rapido: bool = True, falhas=None):
+    """
+    Aplica extrair_dados_cte a vários XMLs, gerando (caminho, dados)
+    na mesma ordem da lista recebida.
+    Com processos != 1 e lotes grandes, a leitura é distribuída
+    entre processos (processos=None ou 0 usa todos os núcleos).
+    falhas (set), se informado, recebe os caminhos que não puderam ser
+    lidos (dados None por erro de leitura, não por XML inválido).
+    """
+    caminhos = list(caminhos)
+    processos = processos_pool(processos)
+
+    if processos == 1 or len(caminhos) < minimo_paralelo:
+        resultados = (_extrair_dados_ou_falha(caminho, rapido) for caminho in caminhos)
+        executor = None
+    else:
+        tamanho_bloco = max(1, min(256, len(caminhos) // (processos * 8)))
+        executor = ProcessPoolExecutor(max_workers=processos)
+        resultados = executor.map(
+            partial(_extrair_dados_ou_falha, rapido=rapido),
+            caminhos,
+            chunksize=tamanho_bloco
+        )
+
+    try:
+        for caminho, (dados, falhou) in zip(caminhos, resultados):
+            if stop_event and stop_event.is_set():
+                return
+            if falhou and falhas is not None:
+                falhas.add(caminho)
+            yield caminho, dados
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
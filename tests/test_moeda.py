@@ -0,0 +1,137 @@
+import random
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.generalsutils import converter_moeda_para_decimal
+from src.moeda import ratear, ratear_grupos, ratear_lote
+from src.planilha import preparar_planilha, valores_em_centavos
+
+CASOS = 300
+
+
+def gerar_grupos(rnd, quantidade, max_total=10_000_000, max_peso=500_000):
+    totais = []
+    grupos = []
+    for _ in range(quantidade):
+        pesos = [rnd.randint(0, max_peso) for _ in range(rnd.randint(1, 12))]
+        if not any(pesos):
+            pesos[rnd.randrange(len(pesos))] = rnd.randint(1, max_peso)
+        totais.append(rnd.randint(-max_total, max_total))
+        grupos.append(pesos)
+    return totais, grupos
+
+
+def conferir_partes(total, pesos, partes):
+    assert sum(partes) == total
+    soma = sum(pesos)
+    for peso, parte in zip(pesos, partes):
+        # |parte - total * peso / soma| < 1 centavo
+        assert abs(parte * soma - total * peso) < soma
+
+
+# =====================================================
+# RATEIO
+# =====================================================
+
+@pytest.mark.parametrize("semente", range(5))
+def test_ratear_soma_exata_e_cota(semente):
+    rnd = random.Random(semente)
+    totais, grupos = gerar_grupos(rnd, CASOS)
+    for total, pesos in zip(totais, grupos):
+        conferir_partes(total, pesos, ratear(total, pesos))
+
+
+@pytest.mark.parametrize("semente", range(5))
+def test_ratear_grupos_igual_ao_ratear(semente):
+    rnd = random.Random(semente)
+    totais, grupos = gerar_grupos(rnd, CASOS)
+    partes = ratear_grupos(totais, grupos)
+    assert partes == [ratear(t, p) for t, p in zip(totais, grupos)]
+    for total, pesos, valores in zip(totais, grupos, partes):
+        conferir_partes(total, pesos, valores)
+
+
+@pytest.mark.parametrize("semente", range(5))
+def test_ratear_lote_igual_ao_ratear(semente):
+    rnd = random.Random(semente)
+    totais, grupos = gerar_grupos(rnd, CASOS)
+    pesos = [p for grupo in grupos for p in grupo]
+    inicios = np.cumsum([0] + [len(g) for g in grupos[:-1]])
+
+    partes = ratear_lote(totais, pesos, inicios).tolist()
+    esperado = [p for t, g in zip(totais, grupos) for p in ratear(t, g)]
+    assert partes == esperado
+
+
+@pytest.mark.parametrize("semente", range(3))
+def test_ratear_lote_estouro_int64(semente):
+    # total * peso >= 2**63: cai para inteiros do Python e precisa dar o mesmo resultado
+    rnd = random.Random(semente)
+    totais, grupos = gerar_grupos(rnd, 50, max_total=10 ** 13, max_peso=10 ** 7)
+    grupos[0][0] = 10 ** 7
+    totais[0] = 10 ** 13
+    assert abs(totais[0]) * max(max(g) for g in grupos) >= 2 ** 63
+
+    partes = ratear_grupos(totais, grupos)
+    assert partes == [ratear(t, p) for t, p in zip(totais, grupos)]
+    for total, pesos, valores in zip(totais, grupos, partes):
+        conferir_partes(total, pesos, valores)
+
+
+def test_ratear_grupos_pesos_zerados():
+    # Grupo cujas linhas somam zero não pode ser rateado (processar o trata como erro)
+    with pytest.raises(ValueError):
+        ratear_grupos([100], [[0]])
+    with pytest.raises(ValueError):
+        ratear(100, [0, 0])
+
+
+# =====================================================
+# CONVERSÃO DA PLANILHA
+# =====================================================
+
+def _valor_aleatorio(rnd):
+    reais = rnd.choice((0, rnd.randint(0, 999), rnd.randint(1000, 10 ** 7)))
+    fracao = rnd.choice(("", str(rnd.randint(0, 9)), f"{rnd.randint(0, 99):02d}", f"{rnd.randint(0, 999):03d}"))
+    sinal = "-" if rnd.random() < 0.1 else ""
+    milhar = f"{reais:,}".replace(",", ".")
+    formato = rnd.randrange(5)
+    if formato == 0:    # 1234,56
+        texto = f"{sinal}{reais}" + (f",{fracao}" if fracao else "")
+    elif formato == 1:  # 1.234,56
+        texto = f"{sinal}{milhar}" + (f",{fracao}" if fracao else ",00")
+    elif formato == 2:  # R$ 1.234,56
+        texto = f"R$ {sinal}{milhar}," + (fracao or "00")
+    elif formato == 3:  # 1234.56 (como o pandas lê células numéricas)
+        texto = f"{sinal}{reais}" + (f".{fracao}" if fracao else "")
+    else:               # inteiro
+        texto = f"{sinal}{reais}"
+    return texto
+
+
+def _esperado(texto):
+    valor = converter_moeda_para_decimal(texto)
+    if valor is None:
+        return 0, False
+    centavos = int((valor * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+    return centavos, valor > 0
+
+
+@pytest.mark.parametrize("semente", range(3))
+def test_valores_em_centavos_igual_ao_conversor(semente):
+    rnd = random.Random(semente)
+    textos = [_valor_aleatorio(rnd) for _ in range(2000)]
+    textos += ["", "nan", "-", "—", None, "abc", "0,004", "0,005", "-0,005", " R$ 12,345 "]
+
+    centavos, positivo = valores_em_centavos(pd.Series(textos, dtype=object))
+    for texto, c, p in zip(textos, centavos.tolist(), positivo.tolist()):
+        assert (c, p) == _esperado(texto), texto
+
+
+def test_preparar_planilha_sem_coluna_obrigatoria():
+    df = pd.DataFrame({"CT-e": ["1"], "Vlr Contabil": ["10,00"], "Operação": ["VENDA"]})
+    with pytest.raises(ValueError, match="N° CT-e"):
+        preparar_planilha(df)